@@ -1,13 +1,29 @@
 import os
+import asyncio
 import logging
+import queue
+import re
 import sqlite3
+import threading
 import zipfile
 import random
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime, timedelta, time, timezone, date
-from math import sqrt
+from math import isqrt
+from time import time as unix_time
+from uuid import uuid4
 
 from dotenv import load_dotenv
 
+try:
+    import zstandard  # 선택 의존성: 있으면 백업을 .db.zst 로 압축 (zip 보다 훨씬 빠름)
+except ImportError:
+    zstandard = None  # 없으면 backup_db_archive 가 .zip 으로 대체
+
 from telegram import (
     Update,
     ChatMemberUpdated,
@@ -30,6 +46,9 @@ load_dotenv()  # .env 파일 읽기
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_PATH = os.getenv("DB_PATH", "xp_bot.db")
+DB_POOL_SIZE = max(1, int(os.getenv("DB_POOL_SIZE", "5")))  # 미리 열어 둘 sqlite 연결 수
+# 풀이 모두 사용 중일 때 반납을 기다리는 최대 시간(초) — 이벤트 루프 스레드가 무한정 멈추지 않도록
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
 
 # 메인 그룹 (랭킹/요약 기준 채팅)
 MAIN_CHAT_ID = int(os.getenv("MAIN_CHAT_ID", "0"))  # 0이면 미지정
@@ -57,8 +76,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 현재 프로세스 메모리에 들고 있는 관리자 목록
-ADMIN_USER_IDS: set[int] = set()
+# KST(UTC+9) 기준 날짜 계산용 상수
+# DB 시각은 UTC(naive ISO)로 저장하므로, KST 날짜 경계는 KST_OFFSET 만큼 빼서 UTC로 변환
+KST_OFFSET = timedelta(hours=9)
+KST = timezone(KST_OFFSET)
+MIDNIGHT = time(0, 0)
+
+
+def kst_now() -> datetime:
+    """현재 KST 시각 (tz-aware)"""
+    return datetime.now(KST)
+
+
+# 현재 프로세스 메모리에 들고 있는 관리자 목록 (reload_admins() 에서만 교체)
+ADMIN_USER_IDS: frozenset[int] = frozenset()
+# 관리자 + OWNER (권한 체크 / 관리자 DM 대상)
+_ADMIN_TARGETS: frozenset[int] = frozenset()
+
+# 관리자 DM 동시 전송 수 (Telegram flood limit 고려)
+ADMIN_DM_CONCURRENCY = 8
+
+# xp_log 는 메모리 버퍼에 모았다가 주기적으로 한 번에 INSERT (초 단위)
+XP_LOG_FLUSH_INTERVAL = 0.2
 
 # 간단한 로터리(추첨) 상태 (chat_id 기준)
 # 예: LOTTERY_STATE[chat_id] = {
@@ -76,14 +115,11 @@ def is_owner(user_id: int) -> bool:
 
 
 def is_admin(user_id: int) -> bool:
-    return is_owner(user_id) or user_id in ADMIN_USER_IDS
+    return user_id in _ADMIN_TARGETS
 
 
-def all_admin_targets() -> set[int]:
-    targets = set(ADMIN_USER_IDS)
-    if OWNER_ID:
-        targets.add(OWNER_ID)
-    return targets
+def all_admin_targets() -> frozenset[int]:
+    return _ADMIN_TARGETS
 
 
 def is_main_chat(chat_id: int) -> bool:
@@ -96,179 +132,412 @@ def is_private_chat(chat) -> bool:
     return chat and chat.type == "private"
 
 
+def _display_name(row, fallback: str = "이름없음") -> str:
+    """user_stats row(username/first_name/last_name) → 표시 이름 (@username 우선)"""
+    if row["username"]:
+        return f"@{row['username']}"
+    fn = row["first_name"] or ""
+    ln = row["last_name"] or ""
+    return (fn + " " + ln).strip() or fallback
+
+
 # -----------------------
 # DB 유틸
 # -----------------------
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+def _open_conn():
+    # 풀의 연결은 to_thread 워커에서도 쓰이므로 check_same_thread=False
+    # 연결마다 컴파일된 statement 를 SQL 문자열 기준으로 캐시 (기본 128개)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # 연결 단위 설정 (journal_mode=WAL 은 init_db 에서 DB 파일에 영구 설정)
+    # WAL 에서는 synchronous=NORMAL 이어도 DB가 깨지지 않음 (크래시 시 마지막 커밋 일부만 유실 가능)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")  # 약 64MB 페이지 캐시
+    conn.execute("PRAGMA busy_timeout=5000")  # 잠금 대기 5초
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
 
+class ConnPool:
+    """
+    미리 열어 둔 sqlite3 연결 풀
+    - 요청마다 connect/close 하지 않으므로 스키마 파싱/페이지 캐시가 유지됨
+    - 연결은 필요할 때 size 개까지 만들고, 이후에는 반납된 연결을 재사용
+    """
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._idle: queue.Queue = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                conn = _open_conn()
+                self._created += 1
+                return conn
+        # 모두 사용 중이면 반납을 기다리되, timeout 이 지나면 예외로 끝냄
+        # (async 핸들러는 이벤트 루프 스레드에서 빌리므로 무한 대기하면 봇 전체가 멈춤)
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            logger.error("DB 연결 풀 고갈 (%s개 모두 사용 중, %.1f초 대기)", self.size, self.timeout)
+            raise sqlite3.OperationalError("DB connection pool exhausted") from None
+
+    def release(self, conn: sqlite3.Connection):
+        self._idle.put(conn)
+
+    def close(self):
+        """반납돼 있는 연결을 모두 닫음 (종료 시 호출)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+DB_POOL = ConnPool(DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+
+@contextmanager
+def borrow_conn(immediate: bool = False):
+    """
+    풀에서 연결을 빌려 쓰고 반납
+    - 정상 종료 시 commit, 예외 시 rollback
+    - immediate=True 면 BEGIN IMMEDIATE 로 시작 (조회 후 쓰기하는 블록에서 쓰기 잠금을 처음부터 확보)
+    - 이벤트 루프를 막지 않도록 with 블록 안에서는 await 하지 말 것
+    """
+    conn = DB_POOL.acquire()
+    try:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        DB_POOL.release(conn)
+
+
+# 설정성 조회(관리자 목록, 키워드, bot_settings, 초대 수) 전용 읽기 전용 연결
+# - 봇 수명 동안 하나만 열어 두어 이 조회들의 statement cache 가 계속 유지됨
+_CFG_CONN: sqlite3.Connection | None = None
+_CFG_LOCK = threading.Lock()
+
+
+@contextmanager
+def config_conn():
+    """설정 조회용 읽기 전용 연결 (처음 사용할 때 열고, 한 번에 한 스레드만 사용)"""
+    global _CFG_CONN
+    with _CFG_LOCK:
+        if _CFG_CONN is None:
+            conn = _open_conn()
+            conn.execute("PRAGMA query_only=1")
+            _CFG_CONN = conn
+        yield _CFG_CONN
+
+
+def close_config_conn():
+    """설정 조회용 연결 닫기 (종료 시 호출)"""
+    global _CFG_CONN
+    with _CFG_LOCK:
+        if _CFG_CONN is not None:
+            _CFG_CONN.close()
+            _CFG_CONN = None
+
+
 def reload_admins():
     """admin_users 테이블에서 관리자 리스트 다시 읽기"""
-    global ADMIN_USER_IDS
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT admin_id FROM admin_users")
-    rows = cur.fetchall()
-    conn.close()
-    ADMIN_USER_IDS = {int(r["admin_id"]) for r in rows}
-    logger.info("Loaded admins: %s", ADMIN_USER_IDS)
+    global ADMIN_USER_IDS, _ADMIN_TARGETS
+    with config_conn() as conn:
+        rows = conn.execute("SELECT admin_id FROM admin_users").fetchall()
+    ADMIN_USER_IDS = frozenset(int(r["admin_id"]) for r in rows)
+    _ADMIN_TARGETS = ADMIN_USER_IDS | {OWNER_ID} if OWNER_ID else ADMIN_USER_IDS
+    logger.info("Loaded admins: %s", sorted(ADMIN_USER_IDS))
 
 
-def ensure_user_stats_columns(cur):
+def ensure_user_stats_columns(conn):
     """
     기존 DB에 새로운 컬럼 추가 (이미 있으면 skip)
     - last_xp_at    : 마지막 XP 부여 시각(UTC ISO)
     - daily_xp      : 마지막 일자 기준 오늘 누적 XP
     - daily_xp_date : 일일 XP 기준 날짜(KST, YYYY-MM-DD)
     """
-    cur.execute("PRAGMA table_info(user_stats)")
-    cols = {row["name"] for row in cur.fetchall()}
+    rows = conn.execute("PRAGMA table_info(user_stats)").fetchall()
+    cols = {row["name"] for row in rows}
 
     if "last_xp_at" not in cols:
-        cur.execute("ALTER TABLE user_stats ADD COLUMN last_xp_at TEXT")
+        conn.execute("ALTER TABLE user_stats ADD COLUMN last_xp_at TEXT")
     if "daily_xp" not in cols:
-        cur.execute("ALTER TABLE user_stats ADD COLUMN daily_xp INTEGER DEFAULT 0")
+        conn.execute("ALTER TABLE user_stats ADD COLUMN daily_xp INTEGER DEFAULT 0")
     if "daily_xp_date" not in cols:
-        cur.execute("ALTER TABLE user_stats ADD COLUMN daily_xp_date TEXT")
+        conn.execute("ALTER TABLE user_stats ADD COLUMN daily_xp_date TEXT")
 
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
+def ensure_xp_log_columns(conn):
+    """
+    xp_log 에 새로운 컬럼 추가 (이미 있으면 skip)
+    - ts : created_at 과 같은 시각의 unix seconds (기간 통계는 정수 비교로 처리)
+    """
+    rows = conn.execute("PRAGMA table_info(xp_log)").fetchall()
+    cols = {row["name"] for row in rows}
 
-    # 유저 XP / 메세지 / 초대수
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_stats (
-            chat_id INTEGER,
-            user_id INTEGER,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            xp INTEGER DEFAULT 0,
-            level INTEGER DEFAULT 1,
-            messages_count INTEGER DEFAULT 0,
-            last_daily TEXT,
-            invites_count INTEGER DEFAULT 0,
-            last_xp_at TEXT,
-            daily_xp INTEGER DEFAULT 0,
-            daily_xp_date TEXT,
-            PRIMARY KEY (chat_id, user_id)
+    if "ts" not in cols:
+        conn.execute("ALTER TABLE xp_log ADD COLUMN ts INTEGER")
+        # created_at(UTC naive ISO)의 초 단위까지만 잘라서 변환 (소수점 초 반올림 방지)
+        conn.execute(
+            """
+            UPDATE xp_log
+            SET ts = CAST(strftime('%s', substr(created_at, 1, 19)) AS INTEGER)
+            WHERE ts IS NULL
+            """
         )
-        """
-    )
+    # created_at 기준 인덱스는 ts 인덱스로 대체
+    conn.execute("DROP INDEX IF EXISTS idx_xplog_cu_time")
 
-    # 초대 링크 테이블
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS invite_links (
-            invite_link TEXT PRIMARY KEY,
-            chat_id INTEGER,
-            inviter_id INTEGER,
-            created_at TEXT,
-            joined_count INTEGER DEFAULT 0
-        )
-        """
-    )
 
-    # 어떤 유저가 어떤 초대 링크로 들어왔는지
-    cur.execute(
+def migrate_xp_keywords_nocase(conn):
+    """
+    xp_keywords 를 현재 스키마(word TEXT COLLATE NOCASE PRIMARY KEY)로 맞춤 (기존 DB용)
+    - word 가 기본 collation 이거나, 예전 마이그레이션이 만든 ux_xp_keywords_word 인덱스가
+      남아 있으면 테이블을 새로 만들어 옮김 (NOCASE 기본키 하나만 unique 인덱스로 사용)
+    - SQLite NOCASE 는 ASCII 만 대소문자를 무시하므로, 단어는 파이썬 str.lower() 로
+      소문자화해서 저장 (메시지 매칭도 lower() 기준) — 대소문자만 다른 중복은 최근 것만 남김
+    """
+    pk_coll = [
+        row["coll"]
+        for idx in conn.execute("PRAGMA index_list(xp_keywords)")
+        if idx["origin"] == "pk"
+        for row in conn.execute(f"PRAGMA index_xinfo({idx['name']})")
+        if row["key"]
+    ]
+    has_extra_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_xp_keywords_word'"
+    ).fetchone()
+    rows = conn.execute("SELECT rowid, word, mode, delta FROM xp_keywords ORDER BY rowid").fetchall()
+    if pk_coll == ["NOCASE"] and not has_extra_index and all(r["word"] == r["word"].lower() for r in rows):
+        return
+
+    latest = {r["word"].lower(): (r["word"].lower(), r["mode"], r["delta"]) for r in rows}
+    conn.execute("DROP TABLE xp_keywords")
+    conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS invited_users (
-            chat_id INTEGER,
-            user_id INTEGER,
-            inviter_id INTEGER,
-            invite_link TEXT,
-            joined_at TEXT,
-            PRIMARY KEY (chat_id, user_id)
+        CREATE TABLE xp_keywords (
+            word TEXT COLLATE NOCASE PRIMARY KEY,
+            mode TEXT NOT NULL,   -- 'bonus' 또는 'block'
+            delta INTEGER DEFAULT 0
         )
         """
     )
+    conn.executemany("INSERT INTO xp_keywords (word, mode, delta) VALUES (?, ?, ?)", latest.values())
 
-    # 관리자 목록
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS admin_users (
-            admin_id INTEGER PRIMARY KEY
-        )
-        """
-    )
 
-    # XP 키워드 (bonus / block)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS xp_keywords (
-            word TEXT PRIMARY KEY,
-            mode TEXT NOT NULL,   -- 'bonus' 또는 'block'
-            delta INTEGER DEFAULT 0
+def drop_uncovered_xp_log_index(conn):
+    """(chat_id, user_id, ts) 인덱스는 xp_delta 까지 포함한 커버링 인덱스로 대체"""
+    conn.execute("DROP INDEX IF EXISTS idx_xplog_cu_ts")
+
+
+def drop_xp_log_created_at_index(conn):
+    """기간 요약도 ts 로 조회하므로 created_at 기준 커버링 인덱스 제거"""
+    conn.execute("DROP INDEX IF EXISTS idx_xplog_c_time_u_xp")
+
+
+def drop_uncovered_username_index(conn):
+    """(chat_id, username) 인덱스는 user_id 까지 포함한 커버링 인덱스로 대체"""
+    conn.execute("DROP INDEX IF EXISTS idx_user_stats_chat_uname")
+
+
+# (버전, 마이그레이션 함수) — 순서대로 적용하고 PRAGMA user_version 에 마지막 버전 기록
+# user_version 도입 전 DB 는 0 이므로 모두 한 번씩 실행됨 (각 함수는 이미 적용된 상태여도 안전)
+MIGRATIONS = [
+    (1, ensure_user_stats_columns),
+    (2, migrate_xp_keywords_nocase),
+    (3, ensure_xp_log_columns),
+    (4, drop_uncovered_xp_log_index),
+    (5, drop_xp_log_created_at_index),
+    (6, drop_uncovered_username_index),
+    # 예전 2번이 NOCASE 기본키 위에 중복 unique 인덱스를 만들었던 DB 정리
+    (7, migrate_xp_keywords_nocase),
+]
+
+
+def run_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migrate in MIGRATIONS:
+        if target > version:
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            logger.info("DB migrated to schema version %s", target)
+
+
+def init_db():
+    with borrow_conn() as conn:
+        # WAL 모드 (DB 파일에 영구 저장됨): 쓰기 중에도 읽기가 막히지 않고, 커밋당 fsync 감소
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        # 유저 XP / 메세지 / 초대수
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_stats (
+                chat_id INTEGER,
+                user_id INTEGER,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                xp INTEGER DEFAULT 0,
+                level INTEGER DEFAULT 1,
+                messages_count INTEGER DEFAULT 0,
+                last_daily TEXT,
+                invites_count INTEGER DEFAULT 0,
+                last_xp_at TEXT,
+                daily_xp INTEGER DEFAULT 0,
+                daily_xp_date TEXT,
+                PRIMARY KEY (chat_id, user_id)
+            )
+            """
         )
-        """
-    )
 
-    # XP 로그 (기간 통계용)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS xp_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER,
-            user_id INTEGER,
-            xp_delta INTEGER,
-            msg_len INTEGER,
-            created_at TEXT
+        # 초대 링크 테이블
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS invite_links (
+                invite_link TEXT PRIMARY KEY,
+                chat_id INTEGER,
+                inviter_id INTEGER,
+                created_at TEXT,
+                joined_count INTEGER DEFAULT 0
+            )
+            """
         )
-        """
-    )
 
-    # 봇 설정값 (안티스팸, 초대 XP, 캠페인 기간 등)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS bot_settings (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            cooldown_seconds INTEGER DEFAULT 7,
-            daily_xp_cap INTEGER DEFAULT 500,
-            invite_xp INTEGER DEFAULT 100,
-            campaign_start TEXT,
-            campaign_end TEXT
+        # 어떤 유저가 어떤 초대 링크로 들어왔는지
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS invited_users (
+                chat_id INTEGER,
+                user_id INTEGER,
+                inviter_id INTEGER,
+                invite_link TEXT,
+                joined_at TEXT,
+                PRIMARY KEY (chat_id, user_id)
+            )
+            """
         )
-        """
-    )
 
-    # user_stats에 새 컬럼이 없는 경우 추가
-    ensure_user_stats_columns(cur)
+        # 관리자 목록
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS admin_users (
+                admin_id INTEGER PRIMARY KEY
+            )
+            """
+        )
 
-    # 최초 관리자 등록
-    for aid in INITIAL_ADMIN_IDS:
-        cur.execute("INSERT OR IGNORE INTO admin_users (admin_id) VALUES (?)", (aid,))
+        # XP 키워드 (bonus / block) — 단어는 str.lower() 로 소문자화해서 저장
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS xp_keywords (
+                word TEXT COLLATE NOCASE PRIMARY KEY,
+                mode TEXT NOT NULL,   -- 'bonus' 또는 'block'
+                delta INTEGER DEFAULT 0
+            )
+            """
+        )
 
-    # 기본 키워드(리스트용): ㅋㅋ, ㄱㄱ (단독 처리용, block으로 두지만 로직에서 별도 처리)
-    cur.execute(
-        "INSERT OR IGNORE INTO xp_keywords (word, mode, delta) VALUES (?, 'block', 0)",
-        ("ㅋㅋ",),
-    )
-    cur.execute(
-        "INSERT OR IGNORE INTO xp_keywords (word, mode, delta) VALUES (?, 'block', 0)",
-        ("ㄱㄱ",),
-    )
+        # XP 로그 (기간 통계용)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS xp_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                user_id INTEGER,
+                xp_delta INTEGER,
+                msg_len INTEGER,
+                created_at TEXT,
+                ts INTEGER
+            )
+            """
+        )
 
-    # bot_settings 기본 1행 생성
-    cur.execute("SELECT id FROM bot_settings WHERE id=1")
-    row = cur.fetchone()
-    if not row:
-        cur.execute(
+        # 봇 설정값 (안티스팸, 초대 XP, 캠페인 기간 등)
+        conn.execute(
             """
-            INSERT INTO bot_settings (id, cooldown_seconds, daily_xp_cap, invite_xp)
-            VALUES (1, 7, 500, 100)
+            CREATE TABLE IF NOT EXISTS bot_settings (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                cooldown_seconds INTEGER DEFAULT 7,
+                daily_xp_cap INTEGER DEFAULT 500,
+                invite_xp INTEGER DEFAULT 100,
+                campaign_start TEXT,
+                campaign_end TEXT
+            )
             """
         )
 
-    conn.commit()
-    conn.close()
+        # 기존 DB 스키마 마이그레이션 (아직 적용되지 않은 버전만)
+        run_migrations(conn)
 
+        # xp_log 집계용 커버링 인덱스 (xp_delta 까지 포함해 테이블을 읽지 않고 인덱스만으로 SUM)
+        # - 유저별 기간 합계(/stats, /userstats)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_xplog_cu_ts_xp "
+            "ON xp_log(chat_id, user_id, ts, xp_delta)"
+        )
+        # - 기간 요약(/today, /week, /range, 일일 요약)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_xplog_c_ts_u_xp "
+            "ON xp_log(chat_id, ts, user_id, xp_delta)"
+        )
+        # @username → user_id 조회(_lookup_username) 용 커버링 인덱스 (테이블을 읽지 않음)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_user_stats_username_lookup "
+            "ON user_stats(chat_id, username, user_id) WHERE username IS NOT NULL"
+        )
+        # 초대 링크 합산(get_invite_count_for_user) 용 인덱스
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invlinks_inviter "
+            "ON invite_links(inviter_id, chat_id)"
+        )
+
+        # 최초 관리자 등록
+        conn.executemany(
+            "INSERT OR IGNORE INTO admin_users (admin_id) VALUES (?)",
+            [(aid,) for aid in INITIAL_ADMIN_IDS],
+        )
+
+        # 기본 키워드(리스트용): ㅋㅋ, ㄱㄱ (단독 처리용, block으로 두지만 로직에서 별도 처리)
+        conn.executemany(
+            "INSERT OR IGNORE INTO xp_keywords (word, mode, delta) VALUES (?, 'block', 0)",
+            [("ㅋㅋ",), ("ㄱㄱ",)],
+        )
+
+        # bot_settings 기본 1행 생성
+        row = conn.execute("SELECT id FROM bot_settings WHERE id=1").fetchone()
+        if not row:
+            conn.execute(
+                """
+                INSERT INTO bot_settings (id, cooldown_seconds, daily_xp_cap, invite_xp)
+                VALUES (1, 7, 500, 100)
+                """
+            )
+
+        # 인덱스 통계 갱신 (쿼리 플래너가 위 인덱스를 선택하도록)
+        conn.execute("ANALYZE")
+
+    reload_settings()
+    invalidate_xp_keywords_cache()
     reload_admins()
 
 
@@ -277,18 +546,21 @@ def init_db():
 # -----------------------
 
 
-def get_settings():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT cooldown_seconds, daily_xp_cap, invite_xp,
-               campaign_start, campaign_end
-        FROM bot_settings WHERE id=1
-        """
-    )
-    row = cur.fetchone()
-    conn.close()
+# bot_settings 1행 캐시 (update_settings / init_db 에서 reload_settings() 로 교체)
+_SETTINGS_CACHE: dict | None = None
+# 캠페인 기간 (start_ts, end_ts) — 설정을 읽을 때 한 번만 계산 (미설정이면 None)
+_CAMPAIGN_RANGE: tuple[int, int] | None = None
+
+
+def _load_settings_from_db():
+    with config_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT cooldown_seconds, daily_xp_cap, invite_xp,
+                   campaign_start, campaign_end
+            FROM bot_settings WHERE id=1
+            """
+        ).fetchone()
     if not row:
         return {
             "cooldown_seconds": 7,
@@ -306,6 +578,28 @@ def get_settings():
     }
 
 
+def get_settings():
+    """bot_settings 조회 (메시지마다 호출되므로 캐시된 dict 반환, 수정하지 말 것)"""
+    if _SETTINGS_CACHE is None:
+        reload_settings()
+    return _SETTINGS_CACHE
+
+
+def get_campaign_range():
+    """현재 캠페인 기간 (start_ts, end_ts) 또는 None"""
+    if _SETTINGS_CACHE is None:
+        reload_settings()
+    return _CAMPAIGN_RANGE
+
+
+def reload_settings():
+    """bot_settings 를 다시 읽어 캐시 교체 (설정 변경 후 호출)"""
+    global _SETTINGS_CACHE, _CAMPAIGN_RANGE
+    settings = _load_settings_from_db()
+    _CAMPAIGN_RANGE = _campaign_range_utc(settings)
+    _SETTINGS_CACHE = settings
+
+
 def update_settings(**kwargs):
     """
     예: update_settings(cooldown_seconds=10, daily_xp_cap=1000)
@@ -319,14 +613,146 @@ def update_settings(**kwargs):
             values.append(v)
     if not fields:
         return
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        f"UPDATE bot_settings SET {', '.join(fields)} WHERE id=1",
-        tuple(values),
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(
+            f"UPDATE bot_settings SET {', '.join(fields)} WHERE id=1",
+            tuple(values),
+        )
+    reload_settings()
+
+
+# -----------------------
+# 자주 실행되는 SQL (sqlite3 statement cache 가 SQL 문자열 기준이므로 한 곳에서 정의해 재사용)
+# -----------------------
+
+# 누적 XP 는 DB 에서 더하고 갱신된 값을 RETURNING 으로 돌려받음 (SELECT 없이 한 번에)
+# level 은 여기서 바꾸지 않으므로 RETURNING level 은 갱신 전 레벨 (신규 유저는 1)
+SQL_ADD_XP_UPSERT = """
+INSERT INTO user_stats
+(chat_id, user_id, username, first_name, last_name, xp, level, messages_count)
+VALUES (?, ?, ?, ?, ?, ?, 1, 1)
+ON CONFLICT(chat_id, user_id) DO UPDATE SET
+  username=excluded.username,
+  first_name=excluded.first_name,
+  last_name=excluded.last_name,
+  xp=xp + excluded.xp,
+  messages_count=messages_count + 1
+RETURNING xp, level, messages_count
+"""
+
+# 이름 정보 없이 XP 지급 (/add_xp) — 기존 유저의 이름 컬럼은 그대로 둠
+SQL_GRANT_XP_UPSERT = """
+INSERT INTO user_stats
+(chat_id, user_id, username, first_name, last_name, xp, level, messages_count)
+VALUES (?, ?, NULL, '', '', ?, 1, 1)
+ON CONFLICT(chat_id, user_id) DO UPDATE SET
+  xp=xp + excluded.xp,
+  messages_count=messages_count + 1
+RETURNING xp, level, messages_count
+"""
+
+SQL_SET_LEVEL = "UPDATE user_stats SET level=? WHERE chat_id=? AND user_id=?"
+
+SQL_MESSAGE_XP_SELECT = """
+SELECT username, xp, level, messages_count, last_xp_at, daily_xp, daily_xp_date
+FROM user_stats
+WHERE chat_id=? AND user_id=?
+"""
+
+SQL_MESSAGE_XP_UPSERT = """
+INSERT INTO user_stats
+(chat_id, user_id, username, first_name, last_name, xp, level, messages_count,
+ last_xp_at, daily_xp, daily_xp_date)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(chat_id, user_id) DO UPDATE SET
+  username=excluded.username,
+  first_name=excluded.first_name,
+  last_name=excluded.last_name,
+  xp=excluded.xp,
+  level=excluded.level,
+  messages_count=excluded.messages_count,
+  last_xp_at=excluded.last_xp_at,
+  daily_xp=excluded.daily_xp,
+  daily_xp_date=excluded.daily_xp_date
+"""
+
+SQL_XP_LOG_INSERT = """
+INSERT INTO xp_log (chat_id, user_id, xp_delta, msg_len, created_at, ts)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_USER_STATS_SELECT = """
+SELECT username, first_name, last_name,
+       xp, level, messages_count, invites_count, last_daily
+FROM user_stats
+WHERE chat_id=? AND user_id=?
+"""
+
+SQL_USER_ID_BY_USERNAME_IN_CHAT = (
+    "SELECT user_id FROM user_stats WHERE chat_id=? AND username=? LIMIT 1"
+)
+SQL_USER_ID_BY_USERNAME = "SELECT user_id FROM user_stats WHERE username=? LIMIT 1"
+
+# XP TOP 10 + 전체 유저 수 (COUNT(*) OVER () 로 같은 쿼리에서 함께 조회) — 일일 요약 / 리셋 스냅샷
+SQL_XP_TOP10_WITH_TOTAL = """
+SELECT username, first_name, last_name, xp, level,
+       COUNT(*) OVER () AS total_users
+FROM user_stats
+WHERE chat_id=?
+ORDER BY xp DESC
+LIMIT 10
+"""
+
+# 기간 요약 (_build_range_summary)
+# - 총 메시지 수 / 활동 유저 수 / 신규 유저 수: 기간 필터(win)를 한 번만 정의해 한 쿼리로 계산
+#   기간 내 기록이 없으면 신규 유저도 0명이므로 전체 로그를 훑는 신규 유저 계산은 건너뜀
+SQL_RANGE_COUNTS = """
+WITH win AS (
+  SELECT user_id
+  FROM xp_log
+  WHERE chat_id=? AND ts >= ? AND ts < ?
+)
+SELECT (SELECT COUNT(*) FROM win) AS msg_count,
+       (SELECT COUNT(DISTINCT user_id) FROM win) AS user_count,
+       CASE WHEN EXISTS (SELECT 1 FROM win) THEN (
+         SELECT COUNT(*)
+         FROM (
+           SELECT user_id, MIN(ts) AS first_at
+           FROM xp_log
+           WHERE chat_id=?
+           GROUP BY user_id
+           HAVING first_at >= ? AND first_at < ?
+         ) t
+       ) ELSE 0 END AS new_users
+"""
+
+# - XP 기준 TOP 10 (user_id 로만 집계, 이름은 상위 10명만 따로 조회)
+SQL_RANGE_TOP10 = """
+SELECT user_id,
+       SUM(xp_delta) AS total_xp,
+       COUNT(*) AS msg_cnt
+FROM xp_log
+WHERE chat_id=? AND ts >= ? AND ts < ?
+GROUP BY user_id
+ORDER BY total_xp DESC
+LIMIT 10
+"""
+
+# 초대 링크 입장: 링크 joined_count 증가 + 초대자 invites_count 증가 (조회 없이 2문장)
+SQL_INVITE_LINK_JOIN = """
+UPDATE invite_links SET joined_count=joined_count+1
+WHERE invite_link=? AND chat_id=?
+RETURNING inviter_id
+"""
+
+SQL_INVITER_UPSERT = """
+INSERT INTO user_stats
+(chat_id,user_id,xp,level,messages_count,last_daily,invites_count)
+VALUES (?,?,0,1,0,NULL,1)
+ON CONFLICT(chat_id, user_id) DO UPDATE SET
+  invites_count=COALESCE(invites_count, 0)+1
+RETURNING username, first_name, last_name
+"""
 
 
 # -----------------------
@@ -336,107 +762,180 @@ def update_settings(**kwargs):
 
 def calc_level(xp: int) -> int:
     # xp가 커질수록 레벨업이 점점 어려워지도록
-    return int(sqrt(xp / 100)) + 1 if xp > 0 else 1
+    # 정수 연산만 사용 (floor(sqrt(xp/100)) == isqrt(xp // 100))
+    return isqrt(max(0, xp) // 100) + 1
+
+
+# 레벨별 다음 레벨 필요 XP (level -> level^2 * 100), 범위를 넘으면 직접 계산
+_NEXT_XP_TABLE = tuple(lv * lv * 100 for lv in range(1024))
 
 
 def xp_for_next_level(level: int) -> int:
-    next_level = level + 1
-    return int((next_level - 1) ** 2 * 100)
+    if 0 <= level < len(_NEXT_XP_TABLE):
+        return _NEXT_XP_TABLE[level]
+    return level * level * 100
+
+
+# (unix seconds, ISO 문자열) — 같은 초 안에서는 ISO 문자열을 다시 만들지 않음
+_NOW_STAMP_CACHE: tuple[int, str] = (0, "")
+
+
+def _now_stamp() -> tuple[int, str]:
+    """현재 UTC 시각 (unix seconds, ISO 문자열) — xp_log ts / created_at 용"""
+    global _NOW_STAMP_CACHE
+    now = int(unix_time())
+    stamp = _NOW_STAMP_CACHE
+    if now != stamp[0]:
+        stamp = (now, datetime.utcfromtimestamp(now).isoformat())
+        # 튜플 한 번에 교체 (to_thread 워커에서 동시에 불려도 초/문자열이 어긋나지 않음)
+        _NOW_STAMP_CACHE = stamp
+    return stamp
+
+
+# (chat_id, user_id, xp_delta, msg_len, created_at, ts) 대기열
+# deque 의 append/popleft 는 스레드 안전하므로 to_thread 워커에서도 그대로 사용
+_XP_LOG_BUFFER: deque = deque()
 
 
 def log_xp(chat_id: int, user_id: int, xp_delta: int, msg_len: int = 0):
-    """xp_log에 기록 (캠페인/월별 통계를 위해 모든 XP 소스 기록)"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO xp_log (chat_id, user_id, xp_delta, msg_len, created_at)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (
-            chat_id,
-            user_id,
-            xp_delta,
-            msg_len,
-            datetime.utcnow().isoformat(),
-        ),
-    )
-    conn.commit()
-    conn.close()
+    """xp_log에 기록 (캠페인/월별 통계를 위해 모든 XP 소스 기록, 실제 INSERT 는 flush_xp_log)"""
+    ts, iso = _now_stamp()
+    _XP_LOG_BUFFER.append((chat_id, user_id, xp_delta, msg_len, iso, ts))
+
+
+def flush_xp_log() -> int:
+    """버퍼에 쌓인 xp_log 를 executemany 한 번(트랜잭션 1개)으로 기록. 기록한 행 수 반환"""
+    rows = []
+    while _XP_LOG_BUFFER:
+        try:
+            rows.append(_XP_LOG_BUFFER.popleft())
+        except IndexError:
+            break
+    if not rows:
+        return 0
+
+    try:
+        with borrow_conn(immediate=True) as conn:
+            conn.executemany(SQL_XP_LOG_INSERT, rows)
+    except Exception:
+        # 실패한 행은 순서를 유지한 채 버퍼 앞에 되돌려 두고 다음 flush 에서 재시도
+        _XP_LOG_BUFFER.extendleft(reversed(rows))
+        raise
+    return len(rows)
+
+
+async def flush_xp_log_job(context: ContextTypes.DEFAULT_TYPE):
+    if not _XP_LOG_BUFFER:
+        return
+    try:
+        await asyncio.to_thread(flush_xp_log)
+    except Exception:
+        logger.exception("xp_log flush 실패")
+
+
+class SimpleUser:
+    """telegram User 대신 add_xp 에 넘기는 최소 정보 (DB 에 저장된 이름 사용)"""
+
+    def __init__(self, uid, username, first_name, last_name):
+        self.id = uid
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
 
 
 def add_xp(chat_id: int, user, base_xp: int):
-    """XP 추가 후 (xp, level, messages_count) 반환"""
+    """XP 추가 후 (xp, 이전 level, level, messages_count) 반환"""
+    with borrow_conn(immediate=True) as conn:
+        return add_xp_in(conn, chat_id, user, base_xp)
+
+
+def add_xp_in(conn, chat_id: int, user, base_xp: int):
+    """이미 열린 트랜잭션(conn) 안에서 XP 추가 — 반환값은 add_xp 와 같음"""
     user_id = user.id
     username = user.username
     first_name = user.first_name or ""
     last_name = user.last_name or ""
 
-    conn = get_conn()
-    cur = conn.cursor()
+    gained = max(0, base_xp)
 
-    cur.execute(
-        "SELECT xp, level, messages_count FROM user_stats WHERE chat_id=? AND user_id=?",
-        (chat_id, user_id),
-    )
-    row = cur.fetchone()
+    row = conn.execute(
+        SQL_ADD_XP_UPSERT,
+        (
+            chat_id,
+            user_id,
+            username,
+            first_name,
+            last_name,
+            gained,
+        ),
+    ).fetchone()
+    return _sync_level(conn, chat_id, user_id, row)
 
-    if not row:
-        xp = max(0, base_xp)
-        level = calc_level(xp)
-        messages_count = 1
-        cur.execute(
-            """
-            INSERT INTO user_stats
-            (chat_id, user_id, username, first_name, last_name, xp, level, messages_count)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                chat_id,
-                user_id,
-                username,
-                first_name,
-                last_name,
-                xp,
-                level,
-                messages_count,
-            ),
-        )
-    else:
-        xp = row["xp"] + max(0, base_xp)
-        level = calc_level(xp)
-        messages_count = row["messages_count"] + 1
-        cur.execute(
-            """
-            UPDATE user_stats
-            SET username=?, first_name=?, last_name=?, xp=?, level=?, messages_count=?
-            WHERE chat_id=? AND user_id=?
-            """,
-            (
-                username,
-                first_name,
-                last_name,
-                xp,
-                level,
-                messages_count,
-                chat_id,
-                user_id,
-            ),
-        )
 
-    conn.commit()
-    conn.close()
-    return xp, level, messages_count
+def grant_xp_in(conn, chat_id: int, user_id: int, base_xp: int):
+    """이름 정보 없이 XP 추가 (기존 이름은 유지) — 반환값은 add_xp 와 같음"""
+    row = conn.execute(SQL_GRANT_XP_UPSERT, (chat_id, user_id, max(0, base_xp))).fetchone()
+    return _sync_level(conn, chat_id, user_id, row)
+
+
+def _sync_level(conn, chat_id: int, user_id: int, row):
+    """XP upsert 의 RETURNING row 로 레벨 계산, 바뀐 경우(드묾)에만 level 갱신"""
+    xp = row["xp"]
+    old_level = row["level"]
+    level = calc_level(xp)
+    if level != old_level:
+        conn.execute(SQL_SET_LEVEL, (level, chat_id, user_id))
+    return xp, old_level, level, row["messages_count"]
+
+
+# xp_keywords 전체 캐시 (키워드 추가/삭제 시 invalidate_xp_keywords_cache() 로 비움)
+_KEYWORDS_CACHE: list | None = None
 
 
 def get_xp_keywords():
     """xp_keywords 전체 조회"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT word, mode, delta FROM xp_keywords")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    global _KEYWORDS_CACHE
+    if _KEYWORDS_CACHE is None:
+        with config_conn() as conn:
+            _KEYWORDS_CACHE = conn.execute("SELECT word, mode, delta FROM xp_keywords").fetchall()
+    return _KEYWORDS_CACHE
+
+
+# handle_message 용으로 가공한 키워드 (block 정규식, bonus (소문자 단어, delta) 목록)
+_KEYWORD_MATCHERS: tuple | None = None
+
+
+def get_keyword_matchers():
+    """
+    (block_re, bonus_words) 반환
+    - block_re   : block 키워드 전체를 하나로 묶은 정규식 (없으면 None), 소문자 텍스트에 search
+    - bonus_words: [(소문자 단어, delta), ...]
+    ㅋㅋ / ㄱㄱ 는 단독 메시지에서만 별도 처리하므로 제외
+    """
+    global _KEYWORD_MATCHERS
+    if _KEYWORD_MATCHERS is None:
+        block_words = []
+        bonus_words = []
+        for row in get_xp_keywords():
+            word = row["word"]
+            if not word or word in ("ㅋㅋ", "ㄱㄱ"):
+                continue
+            if row["mode"] == "block":
+                block_words.append(word.lower())
+            elif row["mode"] == "bonus":
+                bonus_words.append((word.lower(), row["delta"] or 0))
+
+        block_re = None
+        if block_words:
+            block_re = re.compile("|".join(map(re.escape, block_words)))
+        _KEYWORD_MATCHERS = (block_re, bonus_words)
+    return _KEYWORD_MATCHERS
+
+
+def invalidate_xp_keywords_cache():
+    global _KEYWORDS_CACHE, _KEYWORD_MATCHERS
+    _KEYWORDS_CACHE = None
+    _KEYWORD_MATCHERS = None
 
 
 # -----------------------
@@ -445,28 +944,26 @@ def get_xp_keywords():
 
 
 def get_invite_count_for_user(user_id: int) -> int:
-    conn = get_conn()
-    cur = conn.cursor()
-    if MAIN_CHAT_ID != 0:
-        cur.execute(
-            """
-            SELECT COALESCE(SUM(joined_count),0) AS c
-            FROM invite_links
-            WHERE inviter_id=? AND chat_id=?
-            """,
-            (user_id, MAIN_CHAT_ID),
-        )
-    else:
-        cur.execute(
-            """
-            SELECT COALESCE(SUM(joined_count),0) AS c
-            FROM invite_links
-            WHERE inviter_id=?
-            """,
-            (user_id,),
-        )
-    row = cur.fetchone()
-    conn.close()
+    with config_conn() as conn:
+        if MAIN_CHAT_ID != 0:
+            cur = conn.execute(
+                """
+                SELECT COALESCE(SUM(joined_count),0) AS c
+                FROM invite_links
+                WHERE inviter_id=? AND chat_id=?
+                """,
+                (user_id, MAIN_CHAT_ID),
+            )
+        else:
+            cur = conn.execute(
+                """
+                SELECT COALESCE(SUM(joined_count),0) AS c
+                FROM invite_links
+                WHERE inviter_id=?
+                """,
+                (user_id,),
+            )
+        row = cur.fetchone()
     return int(row["c"] or 0)
 
 
@@ -475,18 +972,13 @@ def get_invite_count_for_user(user_id: int) -> int:
 # -----------------------
 
 
-def _is_emoji_only(text: str) -> bool:
-    """대충 이모지/기호만 있는지 검사 (한글/영문/숫자 없으면 이모지로 간주)"""
-    stripped = "".join(ch for ch in text if not ch.isspace())
-    if not stripped:
-        return False
-    for ch in stripped:
-        if ch.isalnum():
-            return False
-        # 한글
-        if "가" <= ch <= "힣":
-            return False
-    return True
+# 글자/숫자(str.isalnum 과 동일, 한글 포함) 1개라도 있으면 매치
+_ALNUM_RE = re.compile(r"[^\W_]")
+
+
+def _is_emoji_only(no_space: str) -> bool:
+    """대충 이모지/기호만 있는지 검사 (한글/영문/숫자 없으면 이모지로 간주). 공백 제거된 텍스트를 받음"""
+    return bool(no_space) and _ALNUM_RE.search(no_space) is None
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -501,12 +993,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     text = message.text or message.caption or ""
     raw = text.strip()
-    no_space = "".join(ch for ch in raw if not ch.isspace())
+    no_space = "".join(raw.split())
 
     # 0) 특수 케이스: ㅋㅋㅋ / ㄱㄱ가 "단독"일 때 (공백 제거 후 전부 ㅋ 또는 전부 ㄱ)
-    only_kek = bool(no_space) and all(ch == "ㅋ" for ch in no_space)
-    only_gg = bool(no_space) and all(ch == "ㄱ" for ch in no_space)
-    only_kek_or_gg = only_kek or only_gg
+    only_kek_or_gg = (
+        bool(no_space)
+        and no_space[0] in ("ㅋ", "ㄱ")
+        and no_space.count(no_space[0]) == len(no_space)
+    )
 
     # 기본 XP (메시지 길이 기반)
     base_xp = 3 + len(no_space) // 20
@@ -516,7 +1010,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         base_xp = 0
 
     # 2) 이모지만 있는 메시지 → XP 0
-    if _is_emoji_only(text):
+    if _is_emoji_only(no_space):
         base_xp = 0
 
     # 3) 단독 ㅋㅋ / 단독 ㄱㄱ → XP 0 (길이에 상관없이)
@@ -524,31 +1018,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         base_xp = 0
 
     # 4) 키워드 기반 보너스/차단
-    keywords = get_xp_keywords()
-    lower_text = text.lower()
     blocked = False
     bonus_total = 0
 
     # 단독 ㅋㅋ / ㄱㄱ 는 위에서 이미 처리했으므로
     # 키워드 블록/보너스 로직에서는 더 이상 영향을 주지 않도록 한다.
     if not only_kek_or_gg:
-        for row in keywords:
-            word = row["word"]
-            mode = row["mode"]
-            delta = row["delta"] or 0
-
-            if not word:
-                continue
-
-            # ㅋㅋ / ㄱㄱ 는 여기서는 스킵 (단독일 때만 처리)
-            if word in ("ㅋㅋ", "ㄱㄱ"):
-                continue
-
-            if word.lower() in lower_text:
-                if mode == "block":
-                    blocked = True
-                elif mode == "bonus":
-                    bonus_total += delta
+        block_re, bonus_words = get_keyword_matchers()
+        # 짧은/이모지 메시지(base_xp 0)라도 보너스 키워드는 XP를 줄 수 있으므로,
+        # 스캔을 생략하는 건 base_xp 가 0이고 보너스 키워드도 없을 때만 (결과가 어차피 0)
+        if base_xp > 0 or bonus_words:
+            lower_text = text.lower()
+            blocked = block_re is not None and block_re.search(lower_text) is not None
+            if not blocked:
+                bonus_total = sum(delta for word, delta in bonus_words if word in lower_text)
 
     if blocked:
         xp_delta = 0
@@ -566,88 +1049,90 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     daily_cap = settings["daily_xp_cap"]
 
     now_utc = datetime.utcnow()
-    now_kst = now_utc + timedelta(hours=9)
+    now_kst = now_utc + KST_OFFSET
     today_kst_str = now_kst.date().isoformat()
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT last_xp_at, daily_xp, daily_xp_date
-        FROM user_stats
-        WHERE chat_id=? AND user_id=?
-        """,
-        (chat.id, user.id),
-    )
-    row = cur.fetchone()
-
-    last_xp_at = None
-    daily_xp_current = 0
-    daily_date = None
+    # 조회 → 안티스팸 계산 → user_stats UPSERT 를 한 트랜잭션(커밋 1회)으로 처리
+    with borrow_conn(immediate=True) as conn:
+        row = conn.execute(SQL_MESSAGE_XP_SELECT, (chat.id, user.id)).fetchone()
 
-    if row:
-        if row["last_xp_at"]:
-            try:
-                last_xp_at = datetime.fromisoformat(row["last_xp_at"])
-            except Exception:
-                last_xp_at = None
-        daily_xp_current = row["daily_xp"] or 0
-        daily_date = row["daily_xp_date"]
+        # username 이 바뀐 유저가 있으면 @username → user_id 캐시를 비움 (아래 UPSERT 로 갱신됨)
+        if row and row["username"] != user.username:
+            _lookup_username.cache_clear()
 
-    # 날짜가 바뀌면 오늘 일일 XP 0으로 리셋
-    if daily_date != today_kst_str:
+        last_xp_at = None
         daily_xp_current = 0
+        daily_date = None
+
+        if row:
+            if row["last_xp_at"]:
+                try:
+                    last_xp_at = datetime.fromisoformat(row["last_xp_at"])
+                except Exception:
+                    last_xp_at = None
+            daily_xp_current = row["daily_xp"] or 0
+            daily_date = row["daily_xp_date"]
+
+        # 날짜가 바뀌면 오늘 일일 XP 0으로 리셋
+        if daily_date != today_kst_str:
+            daily_xp_current = 0
+
+        # 쿨다운 적용
+        if xp_delta > 0 and cooldown_sec > 0 and last_xp_at is not None:
+            if (now_utc - last_xp_at).total_seconds() < cooldown_sec:
+                xp_delta = 0
+
+        # 일일 상한 적용
+        if xp_delta > 0 and daily_cap > 0:
+            if daily_xp_current >= daily_cap:
+                xp_delta = 0
+            else:
+                allowed = daily_cap - daily_xp_current
+                if xp_delta > allowed:
+                    xp_delta = allowed
 
-    # 쿨다운 적용
-    if xp_delta > 0 and cooldown_sec > 0 and last_xp_at is not None:
-        if (now_utc - last_xp_at).total_seconds() < cooldown_sec:
-            xp_delta = 0
-
-    # 일일 상한 적용
-    if xp_delta > 0 and daily_cap > 0:
-        if daily_xp_current >= daily_cap:
-            xp_delta = 0
+        # XP 반영 + messages_count 증가
+        xp = (row["xp"] if row else 0) + xp_delta
+        old_level = row["level"] if row else 1
+        level = calc_level(xp)
+        messages_count = (row["messages_count"] if row else 0) + 1
+
+        # 안티스팸 관련 필드 (XP가 실제로 부여된 경우만 갱신, 아니면 기존 값 유지)
+        if xp_delta > 0:
+            last_xp_at_str = now_utc.isoformat()
+            new_daily_xp = daily_xp_current + xp_delta
+            new_daily_date = today_kst_str
+        elif row:
+            last_xp_at_str = row["last_xp_at"]
+            new_daily_xp = row["daily_xp"] or 0
+            new_daily_date = row["daily_xp_date"]
         else:
-            allowed = daily_cap - daily_xp_current
-            if xp_delta > allowed:
-                xp_delta = allowed
-
-    conn.close()
+            last_xp_at_str = None
+            new_daily_xp = 0
+            new_daily_date = None
 
-    # XP 반영 + messages_count 증가
-    xp, level, _ = add_xp(chat.id, user, xp_delta)
-
-    # 안티스팸 관련 필드 업데이트 (XP가 실제로 부여된 경우만)
-    if xp_delta > 0:
-        conn = get_conn()
-        cur = conn.cursor()
-        new_daily_xp = daily_xp_current + xp_delta
-        cur.execute(
-            """
-            UPDATE user_stats
-            SET last_xp_at=?, daily_xp=?, daily_xp_date=?
-            WHERE chat_id=? AND user_id=?
-            """,
+        conn.execute(
+            SQL_MESSAGE_XP_UPSERT,
             (
-                now_utc.isoformat(),
-                new_daily_xp,
-                today_kst_str,
                 chat.id,
                 user.id,
+                user.username,
+                user.first_name or "",
+                user.last_name or "",
+                xp,
+                level,
+                messages_count,
+                last_xp_at_str,
+                new_daily_xp,
+                new_daily_date,
             ),
         )
-        conn.commit()
-        conn.close()
 
     # XP 로그 기록 (메시지 수/기간 통계용, xp_delta가 0이어도 기록)
-    try:
-        log_xp(chat.id, user.id, xp_delta, msg_len=len(no_space))
-    except Exception:
-        logger.exception("xp_log insert 실패")
+    log_xp(chat.id, user.id, xp_delta, msg_len=len(no_space))
 
     # 레벨업 알림
-    old_xp = xp - xp_delta
-    if xp_delta > 0 and level > calc_level(old_xp):
+    if xp_delta > 0 and level > old_level:
         await message.reply_text(
             f"🎉 {user.mention_html()} 님이 레벨업 했습니다!\n➡️ 현재 레벨: {level}",
             parse_mode="HTML",
@@ -695,6 +1180,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "/week - 최근 7일 메인 그룹 요약(KST)\n"
                 "/range YYYY-MM-DD YYYY-MM-DD - 기간별 요약(KST)\n"
                 "/addxpbonus <word> <xp> - 키워드 보너스 XP 등록\n"
+                "/addxpbonuses <word:xp> ... - 키워드 보너스 XP 여러 개 등록\n"
                 "/addxpblock <word> - 키워드 차단 등록\n"
                 "/delxpword <word> - 키워드 삭제\n"
                 "/listxpwords - 키워드 목록\n"
@@ -724,33 +1210,77 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -----------------------
 
 
+def _kst_midnight_ts(d: date) -> int:
+    """KST 기준 해당 날짜 00:00 의 unix seconds"""
+    return int(datetime.combine(d, MIDNIGHT, tzinfo=KST).timestamp())
+
+
 def _get_month_range_kst(target_date: date):
-    """해당 날짜가 속한 월의 KST 기준 시작/끝(UTC ISO)"""
-    start_kst = datetime(target_date.year, target_date.month, 1)
-    if target_date.month == 12:
-        next_kst = datetime(target_date.year + 1, 1, 1)
+    """해당 날짜가 속한 월의 KST 기준 시작/끝 (unix seconds)"""
+    return _month_range_ts(target_date.year, target_date.month)
+
+
+@lru_cache(maxsize=32)
+def _month_range_ts(year: int, month: int):
+    # 월 경계는 바뀌지 않으므로 (연, 월) 단위로 캐시
+    start_kst = date(year, month, 1)
+    if month == 12:
+        next_kst = date(year + 1, 1, 1)
     else:
-        next_kst = datetime(target_date.year, target_date.month + 1, 1)
+        next_kst = date(year, month + 1, 1)
+    return _kst_midnight_ts(start_kst), _kst_midnight_ts(next_kst)
 
-    start_utc = start_kst - timedelta(hours=9)
-    end_utc = next_kst - timedelta(hours=9)
-    return start_utc.isoformat(), end_utc.isoformat()
 
+def _campaign_range_utc(settings):
+    """설정된 캠페인 기간(KST 날짜)의 시작/끝 unix seconds (미설정/형식 오류면 None)"""
+    if not (settings["campaign_start"] and settings["campaign_end"]):
+        return None
+    try:
+        cs = date.fromisoformat(settings["campaign_start"])
+        ce = date.fromisoformat(settings["campaign_end"])
+    except Exception:
+        return None
+    return _kst_midnight_ts(cs), _kst_midnight_ts(ce + timedelta(days=1))
 
-def _sum_xp_in_range(chat_id: int, user_id: int, start_iso: str, end_iso: str) -> int:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT COALESCE(SUM(xp_delta),0) AS s
-        FROM xp_log
-        WHERE chat_id=? AND user_id=? AND created_at >= ? AND created_at < ?
-        """,
-        (chat_id, user_id, start_iso, end_iso),
+
+def _xp_window_sums(chat_id: int, user_id: int, windows) -> list[int]:
+    """[(start_ts, end_ts), ...] 각 구간의 XP 합계를 조건부 집계 쿼리 한 번으로 계산"""
+    sums = ",\n".join(
+        "COALESCE(SUM(CASE WHEN ts >= ? AND ts < ? THEN xp_delta END), 0)"
+        for _ in windows
     )
-    row = cur.fetchone()
-    conn.close()
-    return int(row["s"] or 0)
+    params = [bound for window in windows for bound in window]
+    # 전체 구간으로 먼저 좁혀서 (chat_id, user_id, ts) 인덱스 범위만 읽음
+    lo = min(start for start, _ in windows)
+    hi = max(end for _, end in windows)
+    with borrow_conn() as conn:
+        row = conn.execute(
+            f"""
+            SELECT {sums}
+            FROM xp_log
+            WHERE chat_id=? AND user_id=? AND ts >= ? AND ts < ?
+            """,
+            (*params, chat_id, user_id, lo, hi),
+        ).fetchone()
+    return [int(v) for v in row]
+
+
+def _user_period_xp(chat_id: int, user_id: int, today: date):
+    """(이번 달 XP, 지난 달 XP, 캠페인 XP 또는 None) 반환"""
+    if today.month == 1:
+        prev_date = date(today.year - 1, 12, 1)
+    else:
+        prev_date = date(today.year, today.month - 1, 1)
+
+    windows = [_get_month_range_kst(today), _get_month_range_kst(prev_date)]
+    campaign = get_campaign_range()
+    if campaign:
+        windows.append(campaign)
+
+    sums = _xp_window_sums(chat_id, user_id, windows)
+    cur_month_xp, prev_month_xp = sums[0], sums[1]
+    campaign_xp = sums[2] if campaign else None
+    return cur_month_xp, prev_month_xp, campaign_xp
 
 
 # -----------------------
@@ -799,15 +1329,12 @@ async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 통계는 MAIN_CHAT_ID 기준으로 보는게 직관적이라, DM에서도 MAIN_CHAT_ID 기준 사용
     chat_id = MAIN_CHAT_ID or chat.id
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT xp, level, messages_count, last_daily "
-        "FROM user_stats WHERE chat_id=? AND user_id=?",
-        (chat_id, user.id),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with borrow_conn() as conn:
+        row = conn.execute(
+            "SELECT xp, level, messages_count, last_daily "
+            "FROM user_stats WHERE chat_id=? AND user_id=?",
+            (chat_id, user.id),
+        ).fetchone()
 
     if not row:
         await msg.reply_text("아직 경험치 기록이 없습니다.")
@@ -818,38 +1345,11 @@ async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msgs = row["messages_count"]
     next_xp = xp_for_next_level(level)
 
-    now_kst = datetime.utcnow() + timedelta(hours=9)
+    now_kst = kst_now()
     today = now_kst.date()
 
-    # 이번 달 / 지난 달 XP (xp_log 기반)
-    # 이번 달
-    cur_month_start_iso, cur_month_end_iso = _get_month_range_kst(today)
-    cur_month_xp = _sum_xp_in_range(chat_id, user.id, cur_month_start_iso, cur_month_end_iso)
-
-    # 지난 달
-    if today.month == 1:
-        prev_date = date(today.year - 1, 12, 1)
-    else:
-        prev_date = date(today.year, today.month - 1, 1)
-    prev_month_start_iso, prev_month_end_iso = _get_month_range_kst(prev_date)
-    prev_month_xp = _sum_xp_in_range(chat_id, user.id, prev_month_start_iso, prev_month_end_iso)
-
-    # 캠페인 XP
-    settings = get_settings()
-    campaign_xp = None
-    if settings["campaign_start"] and settings["campaign_end"]:
-        try:
-            cs = date.fromisoformat(settings["campaign_start"])
-            ce = date.fromisoformat(settings["campaign_end"])
-            cs_kst = datetime.combine(cs, time(0, 0))
-            ce_kst = datetime.combine(ce + timedelta(days=1), time(0, 0))
-            cs_utc = cs_kst - timedelta(hours=9)
-            ce_utc = ce_kst - timedelta(hours=9)
-            campaign_xp = _sum_xp_in_range(
-                chat_id, user.id, cs_utc.isoformat(), ce_utc.isoformat()
-            )
-        except Exception:
-            campaign_xp = None
+    # 이번 달 / 지난 달 / 캠페인 XP (xp_log 기반, 쿼리 1회)
+    cur_month_xp, prev_month_xp, campaign_xp = _user_period_xp(chat_id, user.id, today)
 
     text = (
         f"📊 {user.full_name} 님의 통계\n\n"
@@ -870,20 +1370,17 @@ async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cmd_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT username, first_name, last_name, xp, level
-        FROM user_stats
-        WHERE chat_id=?
-        ORDER BY xp DESC
-        LIMIT 10
-        """,
-        (chat.id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with borrow_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT username, first_name, last_name, xp, level
+            FROM user_stats
+            WHERE chat_id=?
+            ORDER BY xp DESC
+            LIMIT 10
+            """,
+            (chat.id,),
+        ).fetchall()
 
     if not rows:
         await update.message.reply_text("아직 데이터가 없습니다.")
@@ -893,13 +1390,7 @@ async def cmd_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     medals = ["🥇", "🥈", "🥉"]
 
     for i, row in enumerate(rows, start=1):
-        username = row["username"]
-        if username:
-            name = f"@{username}"
-        else:
-            fn = row["first_name"] or ""
-            ln = row["last_name"] or ""
-            name = (fn + " " + ln).strip() or "이름없음"
+        name = _display_name(row)
         xp = row["xp"]
         level = row["level"]
         prefix = medals[i - 1] if i <= 3 else f"{i}."
@@ -920,80 +1411,67 @@ async def cmd_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     chat_id = MAIN_CHAT_ID or chat.id
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT xp, level, messages_count, last_daily "
-        "FROM user_stats WHERE chat_id=? AND user_id=?",
-        (chat_id, user.id),
-    )
-    row = cur.fetchone()
-
-    now_kst = datetime.utcnow() + timedelta(hours=9)
+    now_kst = kst_now()
     today_str = now_kst.date().isoformat()
     bonus = 50
 
-    if not row:
-        xp = bonus
-        level = calc_level(xp)
-        cur.execute(
-            """
-            INSERT INTO user_stats
-            (chat_id,user_id,username,first_name,last_name,xp,level,messages_count,last_daily)
-            VALUES (?,?,?,?,?,?,?,?,?)
-            """,
-            (
-                chat_id,
-                user.id,
-                user.username,
-                user.first_name or "",
-                user.last_name or "",
-                xp,
-                level,
-                0,
-                today_str,
-            ),
-        )
-        conn.commit()
-        conn.close()
-
-        # 로그 기록
-        log_xp(chat_id, user.id, bonus, msg_len=0)
-
-        await msg.reply_text(f"🎁 일일 보상으로 {bonus} XP를 받았습니다!")
-        return
-
-    last = row["last_daily"]
-    already_today = False
-    if last:
-        # 예전 데이터가 ISO일 수도 있고, 이미 YYYY-MM-DD일 수도 있음
-        if len(last) == 10:
-            # YYYY-MM-DD
-            already_today = (last == today_str)
-        else:
-            try:
-                last_dt = datetime.fromisoformat(last) + timedelta(hours=9)
-                already_today = (last_dt.date().isoformat() == today_str)
-            except Exception:
-                already_today = False
+    # 조회 → 오늘 수령 여부 확인 → 지급(UPSERT) 을 한 트랜잭션으로 처리
+    with borrow_conn(immediate=True) as conn:
+        row = conn.execute(
+            "SELECT xp, last_daily FROM user_stats WHERE chat_id=? AND user_id=?",
+            (chat_id, user.id),
+        ).fetchone()
+
+        last = row["last_daily"] if row else None
+        already_today = False
+        if last:
+            # 예전 데이터가 ISO일 수도 있고, 이미 YYYY-MM-DD일 수도 있음
+            if len(last) == 10:
+                # YYYY-MM-DD
+                already_today = (last == today_str)
+            else:
+                try:
+                    last_dt = datetime.fromisoformat(last) + KST_OFFSET
+                    already_today = (last_dt.date().isoformat() == today_str)
+                except Exception:
+                    already_today = False
+
+        if not already_today:
+            xp = (row["xp"] if row else 0) + bonus
+            level = calc_level(xp)
+            # 신규 유저면 이름 정보와 함께 INSERT, 기존 유저면 xp/level/last_daily 만 갱신
+            conn.execute(
+                """
+                INSERT INTO user_stats
+                (chat_id,user_id,username,first_name,last_name,xp,level,messages_count,last_daily)
+                VALUES (?,?,?,?,?,?,?,?,?)
+                ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                  xp=excluded.xp, level=excluded.level, last_daily=excluded.last_daily
+                """,
+                (
+                    chat_id,
+                    user.id,
+                    user.username,
+                    user.first_name or "",
+                    user.last_name or "",
+                    xp,
+                    level,
+                    0,
+                    today_str,
+                ),
+            )
 
     if already_today:
         await msg.reply_text("⏰ 이미 오늘 일일 보상을 받았습니다.\n내일 00시(KST) 이후에 다시 시도해 주세요.")
-        conn.close()
         return
 
-    xp = row["xp"] + bonus
-    level = calc_level(xp)
-    cur.execute(
-        "UPDATE user_stats SET xp=?,level=?,last_daily=? WHERE chat_id=? AND user_id=?",
-        (xp, level, today_str, chat_id, user.id),
-    )
-    conn.commit()
-    conn.close()
-
     # 로그 기록
     log_xp(chat_id, user.id, bonus, msg_len=0)
 
+    if not row:
+        await msg.reply_text(f"🎁 일일 보상으로 {bonus} XP를 받았습니다!")
+        return
+
     await msg.reply_text(f"🎁 일일 보상으로 {bonus} XP를 받았습니다!\n현재 XP: {xp}, 레벨: {level}")
 
 
@@ -1015,15 +1493,12 @@ async def cmd_mylink(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("메인 그룹에서만 사용할 수 있는 명령어입니다.")
         return
 
-    conn = get_conn()
-    cur = conn.cursor()
-
     # 이미 발급한 초대링크가 있는지 확인
-    cur.execute(
-        "SELECT invite_link FROM invite_links WHERE chat_id=? AND inviter_id=? LIMIT 1",
-        (chat.id, user.id),
-    )
-    row = cur.fetchone()
+    with borrow_conn() as conn:
+        row = conn.execute(
+            "SELECT invite_link FROM invite_links WHERE chat_id=? AND inviter_id=? LIMIT 1",
+            (chat.id, user.id),
+        ).fetchone()
 
     if row:
         await update.message.reply_text(
@@ -1031,7 +1506,6 @@ async def cmd_mylink(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "이 링크를 계속 사용해 주세요.\n\n"
             f"{row['invite_link']}"
         )
-        conn.close()
         return
 
     # 새 초대 링크 생성
@@ -1042,19 +1516,17 @@ async def cmd_mylink(update: Update, context: ContextTypes.DEFAULT_TYPE):
             creates_join_request=False,
         )
     except Exception:
-        conn.close()
         await update.message.reply_text("초대 링크를 생성할 수 없습니다. (봇 권한을 확인해 주세요)")
         return
 
-    cur.execute(
-        """
-        INSERT INTO invite_links (invite_link,chat_id,inviter_id,created_at)
-        VALUES (?,?,?,?)
-        """,
-        (invite.invite_link, chat.id, user.id, datetime.utcnow().isoformat()),
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn(immediate=True) as conn:
+        conn.execute(
+            """
+            INSERT INTO invite_links (invite_link,chat_id,inviter_id,created_at)
+            VALUES (?,?,?,?)
+            """,
+            (invite.invite_link, chat.id, user.id, datetime.utcnow().isoformat()),
+        )
 
     await update.message.reply_text(
         "👥 나만의 초대 링크를 생성했습니다!\n"
@@ -1087,20 +1559,17 @@ async def cmd_invites_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("초대 랭킹은 메인 그룹에서만 확인할 수 있습니다.")
         return
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT username,first_name,last_name,invites_count
-        FROM user_stats
-        WHERE chat_id=? AND invites_count>0
-        ORDER BY invites_count DESC
-        LIMIT 10
-        """,
-        (chat.id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with borrow_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT username,first_name,last_name,invites_count
+            FROM user_stats
+            WHERE chat_id=? AND invites_count>0
+            ORDER BY invites_count DESC
+            LIMIT 10
+            """,
+            (chat.id,),
+        ).fetchall()
 
     if not rows:
         await update.message.reply_text("아직 초대 기록이 없습니다.")
@@ -1108,13 +1577,7 @@ async def cmd_invites_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     lines = ["👥 초대 랭킹 TOP 10\n"]
     for i, row in enumerate(rows, start=1):
-        if row["username"]:
-            name = f"@{row['username']}"
-        else:
-            fn = row["first_name"] or ""
-            ln = row["last_name"] or ""
-            name = (fn + " " + ln).strip() or "이름없음"
-        lines.append(f"{i}. {name} - {row['invites_count']}명")
+        lines.append(f"{i}. {_display_name(row)} - {row['invites_count']}명")
 
     await update.message.reply_text("\n".join(lines))
 
@@ -1140,67 +1603,42 @@ async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
 
         link_url = invite_link.invite_link
-
-        conn = get_conn()
-        cur = conn.cursor()
-
-        cur.execute(
-            "SELECT inviter_id,joined_count FROM invite_links WHERE invite_link=? AND chat_id=?",
-            (link_url, chat.id),
-        )
-        row = cur.fetchone()
-
-        if not row:
-            conn.close()
-            return
-
-        inviter = row["inviter_id"]
-        new_count = row["joined_count"] + 1
-
-        cur.execute(
-            "UPDATE invite_links SET joined_count=? WHERE invite_link=? AND chat_id=?",
-            (new_count, link_url, chat.id),
-        )
-
-        cur.execute(
-            "SELECT invites_count FROM user_stats WHERE chat_id=? AND user_id=?",
-            (chat.id, inviter),
-        )
-        inv_row = cur.fetchone()
-
-        if not inv_row:
-            cur.execute(
-                """
-                INSERT INTO user_stats
-                (chat_id,user_id,xp,level,messages_count,last_daily,invites_count)
-                VALUES (?,?,?,?,?,?,?)
-                """,
-                (chat.id, inviter, 0, 1, 0, None, 1),
-            )
-        else:
-            cnt = inv_row["invites_count"] + 1
-            cur.execute(
-                "UPDATE user_stats SET invites_count=? WHERE chat_id=? AND user_id=?",
-                (cnt, chat.id, inviter),
-            )
-
-        conn.commit()
-        conn.close()
-
-        # 초대 XP 부여
-        settings = get_settings()
-        invite_xp = settings["invite_xp"]
-        if invite_xp > 0:
+        invite_xp = get_settings()["invite_xp"]
+        xp_given = False
+
+        with borrow_conn(immediate=True) as conn:
+            row = conn.execute(SQL_INVITE_LINK_JOIN, (link_url, chat.id)).fetchone()
+
+            if not row:
+                return
+
+            inviter = row["inviter_id"]
+            inv_row = conn.execute(SQL_INVITER_UPSERT, (chat.id, inviter)).fetchone()
+
+            # 초대자 username 이 이미 저장돼 있으면 get_chat_member 없이 같은 트랜잭션에서 XP 부여
+            if invite_xp > 0 and inv_row["username"]:
+                inviter_user = SimpleUser(
+                    inviter,
+                    inv_row["username"],
+                    inv_row["first_name"] or "",
+                    inv_row["last_name"] or "",
+                )
+                add_xp_in(conn, chat.id, inviter_user, invite_xp)
+                xp_given = True
+
+        # 처음 보는 초대자는 텔레그램에서 이름 정보를 받아 XP 부여
+        if invite_xp > 0 and not xp_given:
             try:
                 inviter_member = await context.bot.get_chat_member(chat.id, inviter)
-                inviter_user = inviter_member.user
-                # XP 부여
-                xp, level, _ = add_xp(chat.id, inviter_user, invite_xp)
-                # 로그 기록
-                log_xp(chat.id, inviter_user.id, invite_xp, msg_len=0)
+                add_xp(chat.id, inviter_member.user, invite_xp)
+                xp_given = True
             except Exception:
                 logger.exception("초대 XP 부여 실패")
 
+        # 로그 기록
+        if xp_given:
+            log_xp(chat.id, inviter, invite_xp, msg_len=0)
+
         await context.bot.send_message(
             chat_id=chat.id,
             text=f"👋 {user.full_name} 님이 초대 링크를 통해 입장했습니다! (초대자: {inviter})",
@@ -1221,23 +1659,27 @@ async def _resolve_target_user_id(arg: str):
     if q.isdigit():
         return int(q)
 
-    # username 으로 user_stats 에서 찾기 (MAIN_CHAT_ID 우선)
-    conn = get_conn()
-    cur = conn.cursor()
-    if MAIN_CHAT_ID != 0:
-        cur.execute(
-            "SELECT user_id FROM user_stats WHERE chat_id=? AND username=? LIMIT 1",
-            (MAIN_CHAT_ID, q),
-        )
-    else:
-        cur.execute(
-            "SELECT user_id FROM user_stats WHERE username=? LIMIT 1",
-            (q,),
-        )
-    row = cur.fetchone()
-    conn.close()
-    if not row:
+    try:
+        return _lookup_username(q)
+    except LookupError:
         return None
+
+
+@lru_cache(maxsize=2048)
+def _lookup_username(username: str) -> int:
+    """
+    username 으로 user_stats 에서 user_id 찾기 (MAIN_CHAT_ID 우선)
+    - 찾은 결과만 캐시 (못 찾으면 LookupError — lru_cache 는 예외를 캐시하지 않음)
+    - username 변경은 handle_message 에서 감지해 cache_clear()
+    """
+    with borrow_conn() as conn:
+        if MAIN_CHAT_ID != 0:
+            cur = conn.execute(SQL_USER_ID_BY_USERNAME_IN_CHAT, (MAIN_CHAT_ID, username))
+        else:
+            cur = conn.execute(SQL_USER_ID_BY_USERNAME, (username,))
+        row = cur.fetchone()
+    if not row:
+        raise LookupError(username)
     return int(row["user_id"])
 
 
@@ -1283,14 +1725,11 @@ async def cmd_addadmin(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await msg.reply_text("해당 유저를 찾을 수 없습니다.")
             return
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR IGNORE INTO admin_users (admin_id) VALUES (?)",
-        (target_id,),
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO admin_users (admin_id) VALUES (?)",
+            (target_id,),
+        )
 
     reload_admins()
 
@@ -1323,11 +1762,8 @@ async def cmd_deladmin(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await msg.reply_text("해당 유저를 찾을 수 없습니다.")
             return
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM admin_users WHERE admin_id=?", (target_id,))
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute("DELETE FROM admin_users WHERE admin_id=?", (target_id,))
 
     reload_admins()
 
@@ -1355,6 +1791,22 @@ async def cmd_refuser(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await msg.reply_text(f"해당 유저 초대 인원: {count}명")
 
 
+# /userstats 응답 템플릿
+_USERSTATS_TMPL = (
+    "📊 {name} 님의 스탯\n\n"
+    "🎯 레벨: {level}\n"
+    "⭐ 총 경험치(Total XP): {xp}\n"
+    "📈 다음 레벨까지: {to_next} XP\n"
+    "💬 메시지 수: {msgs}\n"
+    "👥 초대 인원(user_stats.invites_count): {invites_db}명\n"
+    "👥 초대 인원(invite_links 합산): {invites_links}명\n"
+    "🕒 마지막 일일보상 일자(KST 기준): {last_daily}\n\n"
+    "📆 이번 달 XP: {cur_month_xp}\n"
+    "📆 지난 달 XP: {prev_month_xp}\n"
+)
+_USERSTATS_CAMPAIGN_TMPL = "🏁 현재 설정된 캠페인 기간 XP: {campaign_xp}\n"
+
+
 async def cmd_userstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """관리자용: /userstats <@handle 또는 user_id> → 유저 스탯 조회 (총/월/캠페인)"""
     admin = update.effective_user
@@ -1376,30 +1828,14 @@ async def cmd_userstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     chat_id = MAIN_CHAT_ID or msg.chat_id
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT username, first_name, last_name,
-               xp, level, messages_count, invites_count, last_daily
-        FROM user_stats
-        WHERE chat_id=? AND user_id=?
-        """,
-        (chat_id, target_id),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with borrow_conn() as conn:
+        row = conn.execute(SQL_USER_STATS_SELECT, (chat_id, target_id)).fetchone()
 
     if not row:
         await msg.reply_text("해당 유저의 스탯 기록이 없습니다.")
         return
 
-    if row["username"]:
-        name = f"@{row['username']}"
-    else:
-        fn = row["first_name"] or ""
-        ln = row["last_name"] or ""
-        name = (fn + " " + ln).strip() or f"user_id {target_id}"
+    name = _display_name(row, f"user_id {target_id}")
 
     xp = row["xp"]
     level = row["level"]
@@ -1421,52 +1857,27 @@ async def cmd_userstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         last_daily_str = "기록 없음"
 
-    now_kst = datetime.utcnow() + timedelta(hours=9)
+    now_kst = kst_now()
     today = now_kst.date()
 
-    # 이번 달 / 지난 달 XP
-    cur_month_start_iso, cur_month_end_iso = _get_month_range_kst(today)
-    cur_month_xp = _sum_xp_in_range(chat_id, target_id, cur_month_start_iso, cur_month_end_iso)
-
-    if today.month == 1:
-        prev_date = date(today.year - 1, 12, 1)
-    else:
-        prev_date = date(today.year, today.month - 1, 1)
-    prev_month_start_iso, prev_month_end_iso = _get_month_range_kst(prev_date)
-    prev_month_xp = _sum_xp_in_range(chat_id, target_id, prev_month_start_iso, prev_month_end_iso)
-
-    # 캠페인 XP
-    settings = get_settings()
-    campaign_xp = None
-    if settings["campaign_start"] and settings["campaign_end"]:
-        try:
-            cs = date.fromisoformat(settings["campaign_start"])
-            ce = date.fromisoformat(settings["campaign_end"])
-            cs_kst = datetime.combine(cs, time(0, 0))
-            ce_kst = datetime.combine(ce + timedelta(days=1), time(0, 0))
-            cs_utc = cs_kst - timedelta(hours=9)
-            ce_utc = ce_kst - timedelta(hours=9)
-            campaign_xp = _sum_xp_in_range(
-                chat_id, target_id, cs_utc.isoformat(), ce_utc.isoformat()
-            )
-        except Exception:
-            campaign_xp = None
-
-    text = (
-        f"📊 {name} 님의 스탯\n\n"
-        f"🎯 레벨: {level}\n"
-        f"⭐ 총 경험치(Total XP): {xp}\n"
-        f"📈 다음 레벨까지: {max(0, next_xp - xp)} XP\n"
-        f"💬 메시지 수: {msgs}\n"
-        f"👥 초대 인원(user_stats.invites_count): {invites_db}명\n"
-        f"👥 초대 인원(invite_links 합산): {invites_links}명\n"
-        f"🕒 마지막 일일보상 일자(KST 기준): {last_daily_str}\n\n"
-        f"📆 이번 달 XP: {cur_month_xp}\n"
-        f"📆 지난 달 XP: {prev_month_xp}\n"
+    # 이번 달 / 지난 달 / 캠페인 XP (xp_log 기반, 쿼리 1회)
+    cur_month_xp, prev_month_xp, campaign_xp = _user_period_xp(chat_id, target_id, today)
+
+    text = _USERSTATS_TMPL.format(
+        name=name,
+        level=level,
+        xp=xp,
+        to_next=max(0, next_xp - xp),
+        msgs=msgs,
+        invites_db=invites_db,
+        invites_links=invites_links,
+        last_daily=last_daily_str,
+        cur_month_xp=cur_month_xp,
+        prev_month_xp=prev_month_xp,
     )
 
     if campaign_xp is not None:
-        text += f"🏁 현재 설정된 캠페인 기간 XP: {campaign_xp}\n"
+        text += _USERSTATS_CAMPAIGN_TMPL.format(campaign_xp=campaign_xp)
 
     await msg.reply_text(text)
 
@@ -1476,28 +1887,64 @@ async def cmd_userstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -----------------------
 
 
-def backup_db_to_zip() -> str:
+def backup_db_archive() -> str:
     """
-    xp_bot.db 를 zip으로 압축해서 파일 경로 반환.
+    xp_bot.db 를 압축해서 파일 경로 반환.
     같은 폴더에 timestamp 붙여서 생성.
+    - zstandard 가 설치돼 있으면 .db.zst, 없으면 .zip
+    - 파일 복사/압축에 시간이 걸리므로 asyncio.to_thread 로 호출할 것
     """
     base_dir = os.path.dirname(DB_PATH) or "."
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    zip_name = f"xp_bot_backup_{ts}.zip"
-    zip_path = os.path.join(base_dir, zip_name)
+    # 같은 초에 /resetxp 백업과 daily 백업이 겹쳐도 파일명이 충돌하지 않도록 임의 접미사 추가
+    # (VACUUM INTO 는 대상 파일이 이미 있으면 실패)
+    stem = f"xp_bot_backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid4().hex[:8]}"
+    tmp_path = os.path.join(base_dir, f"{stem}.db.tmp")
+
+    # 아직 버퍼에 있는 xp_log 까지 반영한 뒤 백업
+    flush_xp_log()
+
+    archive_path = None
+    try:
+        # VACUUM INTO 로 일관된 스냅샷을 임시 파일에 생성
+        # (빈 페이지가 빠진 압축된 사본이라 압축/업로드할 크기가 줄고, 원본 DB 는 건드리지 않음)
+        with borrow_conn() as conn:
+            conn.execute("VACUUM INTO ?", (tmp_path,))
+
+        if zstandard is not None:
+            # zstd 레벨 3, 모든 코어 사용 (1MiB 단위로 읽고 써서 호출 횟수를 줄임)
+            archive_path = os.path.join(base_dir, f"{stem}.db.zst")
+            cctx = zstandard.ZstdCompressor(level=3, threads=-1)
+            with open(tmp_path, "rb") as src, open(archive_path, "wb") as out:
+                cctx.copy_stream(src, out, read_size=1 << 20, write_size=1 << 20)
+        else:
+            # 빠른 압축 (레벨 1) — 크기보다 백업 시간을 우선
+            archive_path = os.path.join(base_dir, f"{stem}.zip")
+            with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+                zf.write(tmp_path, arcname=os.path.basename(DB_PATH))
+    except BaseException:
+        # 압축 도중 실패하면 덜 써진 압축 파일은 남기지 않음
+        if archive_path is not None and os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+    finally:
+        # VACUUM INTO 가 중간에 실패해도 남은 임시 파일 정리
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        if os.path.exists(DB_PATH):
-            zf.write(DB_PATH, arcname=os.path.basename(DB_PATH))
+    return archive_path
 
-    return zip_path
+
+def read_file_bytes(path: str) -> bytes:
+    """파일 전체 읽기 (이벤트 루프를 막지 않도록 asyncio.to_thread 로 호출)"""
+    with open(path, "rb") as f:
+        return f.read()
 
 
 async def cmd_resetxp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /resetxp total
     OWNER 전용.
-    - 1단계: '/resetxp total' → 전체 DB 백업 zip 생성 후, 2단계 안내
+    - 1단계: '/resetxp total' → 전체 DB 백업 파일 생성 후, 2단계 안내
     - 2단계: '/resetxp total 동의합니다.' → 실제 리셋 수행
     """
     user = update.effective_user
@@ -1530,59 +1977,37 @@ async def cmd_resetxp(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 2단계 확인: /resetxp total 동의합니다.
     if len(args) >= 2 and " ".join(args[1:]) == confirmation_text:
-        # 실제 리셋 수행
-        conn = get_conn()
-        cur = conn.cursor()
-
-        # 리셋 전 스냅샷 생성
-        cur.execute(
-            """
-            SELECT username, first_name, last_name, xp, level
-            FROM user_stats
-            WHERE chat_id=?
-            ORDER BY xp DESC
-            LIMIT 10
-            """,
-            (MAIN_CHAT_ID,),
-        )
-        rows = cur.fetchall()
-
-        cur.execute(
-            "SELECT COUNT(*) AS c FROM user_stats WHERE chat_id=?",
-            (MAIN_CHAT_ID,),
-        )
-        total_users = cur.fetchone()["c"]
-
-        # 실제 리셋 수행
-        cur.execute(
-            """
-            UPDATE user_stats
-            SET xp=0, level=1, messages_count=0,
-                last_daily=NULL, invites_count=0,
-                last_xp_at=NULL, daily_xp=0, daily_xp_date=NULL
-            WHERE chat_id=?
-            """,
-            (MAIN_CHAT_ID,),
-        )
-        affected = cur.rowcount
-        conn.commit()
-        conn.close()
+        # 실제 리셋 수행 (스냅샷 조회 ~ 리셋을 쓰기 잠금을 잡은 한 트랜잭션에서 처리)
+        with borrow_conn(immediate=True) as conn:
+            # 리셋 전 스냅샷 생성 (TOP 10 + 전체 유저 수를 쿼리 한 번으로)
+            rows = conn.execute(SQL_XP_TOP10_WITH_TOTAL, (MAIN_CHAT_ID,)).fetchall()
+            total_users = rows[0]["total_users"] if rows else 0
+
+            # 실제 리셋 수행
+            affected = conn.execute(
+                """
+                UPDATE user_stats
+                SET xp=0, level=1, messages_count=0,
+                    last_daily=NULL, invites_count=0,
+                    last_xp_at=NULL, daily_xp=0, daily_xp_date=NULL
+                WHERE chat_id=?
+                """,
+                (MAIN_CHAT_ID,),
+            ).rowcount
 
         # 스냅샷 텍스트 구성
         if not rows:
             snapshot_body = "초기화 직전 기록된 데이터가 없습니다."
         else:
-            lines = [f"XP 초기화 직전 스냅샷 (MAIN_CHAT_ID={MAIN_CHAT_ID})\n"]
-            for i, row in enumerate(rows, start=1):
-                if row["username"]:
-                    name = f"@{row['username']}"
-                else:
-                    fn = row["first_name"] or ""
-                    ln = row["last_name"] or ""
-                    name = (fn + " " + ln).strip() or "이름없음"
-                lines.append(f"{i}. {name} - Lv.{row['level']} ({row['xp']} XP)")
-            lines.append(f"\n총 기록된 유저 수: {total_users}명")
-            snapshot_body = "\n".join(lines)
+            ranking = "\n".join(
+                f"{i}. {_display_name(row)} - Lv.{row['level']} ({row['xp']} XP)"
+                for i, row in enumerate(rows, start=1)
+            )
+            snapshot_body = (
+                f"XP 초기화 직전 스냅샷 (MAIN_CHAT_ID={MAIN_CHAT_ID})\n\n"
+                f"{ranking}\n\n"
+                f"총 기록된 유저 수: {total_users}명"
+            )
 
         # OWNER DM 으로 스냅샷 전송
         try:
@@ -1598,12 +2023,14 @@ async def cmd_resetxp(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # 여기까지 오면 '/resetxp total' (백업 + 2단계 안내)
-    # 1단계: 전체 DB 백업 zip 생성 후 OWNER에게 전송
+    # 1단계: 전체 DB 백업 파일 생성 후 OWNER에게 전송
     try:
-        zip_path = backup_db_to_zip()
+        backup_path = await asyncio.to_thread(backup_db_archive)
+        backup_data = await asyncio.to_thread(read_file_bytes, backup_path)
         await msg.bot.send_document(
             chat_id=user.id,
-            document=open(zip_path, "rb"),
+            document=backup_data,
+            filename=os.path.basename(backup_path),
             caption="XP 전체 초기화 전에 생성된 전체 DB 백업입니다.",
         )
     except Exception:
@@ -1640,29 +2067,84 @@ async def cmd_addxpbonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("사용법: /addxpbonus <word> <xp>")
         return
 
-    word = args[0].strip()
+    word = args[0].strip().lower()
     try:
         delta = int(args[1])
     except ValueError:
         await msg.reply_text("XP 값은 정수여야 합니다.")
         return
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO xp_keywords (word, mode, delta)
-        VALUES (?, 'bonus', ?)
-        ON CONFLICT(word) DO UPDATE SET mode='bonus', delta=excluded.delta
-        """,
-        (word, delta),
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO xp_keywords (word, mode, delta)
+            VALUES (?, 'bonus', ?)
+            ON CONFLICT(word COLLATE NOCASE) DO UPDATE SET mode='bonus', delta=excluded.delta
+            """,
+            (word, delta),
+        )
+    invalidate_xp_keywords_cache()
 
     await msg.reply_text(f"✅ '{word}' 를 bonus 키워드로 등록했습니다. (XP +{delta})")
 
 
+async def cmd_addxpbonuses(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /addxpbonuses <word:xp> <word:xp> ...
+    여러 bonus 키워드를 한 번에 등록 (executemany, 한 트랜잭션)
+    """
+    user = update.effective_user
+    chat = update.effective_chat
+    msg = update.message
+    args = context.args
+
+    if not is_admin(user.id):
+        await msg.reply_text("관리자만 사용 가능합니다.")
+        return
+    if not is_private_chat(chat):
+        await msg.reply_text("이 명령어는 봇과의 1:1 대화(디엠)에서만 사용할 수 있습니다.")
+        return
+
+    if not args:
+        await msg.reply_text("사용법: /addxpbonuses <word:xp> <word:xp> ...  (예: /addxpbonuses gm:5 wagmi:10)")
+        return
+
+    pairs = []
+    invalid = []
+    for arg in args:
+        word, sep, delta = arg.rpartition(":")
+        word = word.strip().lower()
+        try:
+            if not sep or not word:
+                raise ValueError
+            pairs.append((word, int(delta)))
+        except ValueError:
+            invalid.append(arg)
+
+    if invalid:
+        await msg.reply_text(
+            "형식이 잘못된 항목이 있어 등록하지 않았습니다. (형식: word:xp, XP는 정수)\n"
+            + "\n".join(f"- {a}" for a in invalid)
+        )
+        return
+
+    with borrow_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO xp_keywords (word, mode, delta)
+            VALUES (?, 'bonus', ?)
+            ON CONFLICT(word COLLATE NOCASE) DO UPDATE SET mode='bonus', delta=excluded.delta
+            """,
+            pairs,
+        )
+    invalidate_xp_keywords_cache()
+
+    await msg.reply_text(
+        f"✅ bonus 키워드 {len(pairs)}개를 등록했습니다.\n"
+        + "\n".join(f"- {word} : +{delta} XP" for word, delta in pairs)
+    )
+
+
 async def cmd_addxpblock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
@@ -1680,20 +2162,18 @@ async def cmd_addxpblock(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("사용법: /addxpblock <word>")
         return
 
-    word = args[0].strip()
+    word = args[0].strip().lower()
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO xp_keywords (word, mode, delta)
-        VALUES (?, 'block', 0)
-        ON CONFLICT(word) DO UPDATE SET mode='block', delta=0
-        """,
-        (word,),
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO xp_keywords (word, mode, delta)
+            VALUES (?, 'block', 0)
+            ON CONFLICT(word COLLATE NOCASE) DO UPDATE SET mode='block', delta=0
+            """,
+            (word,),
+        )
+    invalidate_xp_keywords_cache()
 
     await msg.reply_text(f"✅ '{word}' 를 block 키워드로 등록했습니다. (해당 단어 포함 메시지는 XP 0 처리)")
 
@@ -1715,14 +2195,13 @@ async def cmd_delxpword(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("사용법: /delxpword <word>")
         return
 
-    word = args[0].strip()
+    word = args[0].strip().lower()
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM xp_keywords WHERE word=?", (word,))
-    deleted = cur.rowcount
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        deleted = conn.execute(
+            "DELETE FROM xp_keywords WHERE word = ? COLLATE NOCASE", (word,)
+        ).rowcount
+    invalidate_xp_keywords_cache()
 
     if deleted:
         await msg.reply_text(f"✅ '{word}' 키워드를 삭제했습니다.")
@@ -1742,35 +2221,24 @@ async def cmd_listxpwords(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("이 명령어는 봇과의 1:1 대화(디엠)에서만 사용할 수 있습니다.")
         return
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT word, mode, delta FROM xp_keywords ORDER BY mode, word")
-    rows = cur.fetchall()
-    conn.close()
+    # 캐시된 키워드 목록을 Python 에서 정렬 (word 는 NOCASE 이므로 소문자 기준)
+    rows = sorted(get_xp_keywords(), key=lambda r: (r["mode"], r["word"].lower()))
 
     if not rows:
         await msg.reply_text("등록된 XP 키워드가 없습니다.")
         return
 
-    bonus_lines = []
-    block_lines = []
-    for row in rows:
-        if row["mode"] == "bonus":
-            bonus_lines.append(f"- {row['word']} : +{row['delta']} XP")
+    # rows 는 mode 순으로 정렬돼 있으므로 mode 별 구간을 한 번에 묶음 (Bonus 구간을 먼저 표시)
+    sections = []
+    for mode, group in groupby(rows, key=itemgetter("mode")):
+        if mode == "bonus":
+            body = "\n".join(f"- {row['word']} : +{row['delta']} XP" for row in group)
+            sections.insert(0, f"✨ Bonus 키워드:\n{body}")
         else:
-            block_lines.append(f"- {row['word']} : XP 0 처리")
-
-    lines = []
-    if bonus_lines:
-        lines.append("✨ Bonus 키워드:")
-        lines.extend(bonus_lines)
-    if block_lines:
-        if lines:
-            lines.append("")
-        lines.append("⛔ Block 키워드:")
-        lines.extend(block_lines)
+            body = "\n".join(f"- {row['word']} : XP 0 처리" for row in group)
+            sections.append(f"⛔ Block 키워드:\n{body}")
 
-    await msg.reply_text("\n".join(lines))
+    await msg.reply_text("\n\n".join(sections))
 
 
 # -----------------------
@@ -1949,40 +2417,11 @@ async def cmd_add_xp(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     chat_id = MAIN_CHAT_ID or chat.id
 
-    # 해당 유저의 이름 정보는 user_stats에서 가져오거나, 없으면 placeholder
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT username, first_name, last_name
-        FROM user_stats
-        WHERE chat_id=? AND user_id=?
-        """,
-        (chat_id, target_id),
-    )
-    row = cur.fetchone()
-    conn.close()
-
-    class SimpleUser:
-        def __init__(self, uid, username, first_name, last_name):
-            self.id = uid
-            self.username = username
-            self.first_name = first_name
-            self.last_name = last_name
-
-    if row:
-        u = SimpleUser(
-            target_id,
-            row["username"],
-            row["first_name"] or "",
-            row["last_name"] or "",
-        )
-    else:
-        # 기록이 전혀 없다면 이름 정보 없이 추가
-        u = SimpleUser(target_id, None, "", "")
-
-    xp, level, _ = add_xp(chat_id, u, delta)
-    log_xp(chat_id, target_id, delta, msg_len=0)
+    # XP 지급 + 로그 기록을 한 트랜잭션으로 (이름 정보는 기존 값 유지, 신규면 이름 없이 추가)
+    ts, iso = _now_stamp()
+    with borrow_conn(immediate=True) as conn:
+        xp, _, level, _ = grant_xp_in(conn, chat_id, target_id, delta)
+        conn.execute(SQL_XP_LOG_INSERT, (chat_id, target_id, delta, 0, iso, ts))
 
     await msg.reply_text(
         f"✅ user_id {target_id} 에게 {delta} XP를 지급했습니다.\n"
@@ -2002,70 +2441,41 @@ def _build_range_summary(start_date_kst: date, end_date_kst: date) -> str:
     if MAIN_CHAT_ID == 0:
         return "MAIN_CHAT_ID가 설정되어 있지 않아 요약을 생성할 수 없습니다."
 
-    # KST 날짜범위를 UTC ISO 문자열로 변환
-    start_kst = datetime.combine(start_date_kst, time(0, 0))
-    end_kst = datetime.combine(end_date_kst + timedelta(days=1), time(0, 0))
-
-    start_utc = start_kst - timedelta(hours=9)
-    end_utc = end_kst - timedelta(hours=9)
-
-    start_iso = start_utc.isoformat()
-    end_iso = end_utc.isoformat()
-
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # 총 메시지 수 / 활동 유저 수
-    cur.execute(
-        """
-        SELECT COUNT(*) AS msg_count,
-               COUNT(DISTINCT user_id) AS user_count
-        FROM xp_log
-        WHERE chat_id=? AND created_at >= ? AND created_at < ?
-        """,
-        (MAIN_CHAT_ID, start_iso, end_iso),
-    )
-    base_row = cur.fetchone()
-    msg_count = base_row["msg_count"] or 0
-    user_count = base_row["user_count"] or 0
-
-    # 신규 유저 수 (이 기간에 처음으로 등장한 유저)
-    cur.execute(
-        """
-        SELECT COUNT(*) AS new_users
-        FROM (
-          SELECT user_id, MIN(created_at) AS first_at
-          FROM xp_log
-          WHERE chat_id=?
-          GROUP BY user_id
-          HAVING first_at >= ? AND first_at < ?
-        ) t
-        """,
-        (MAIN_CHAT_ID, start_iso, end_iso),
-    )
-    new_row = cur.fetchone()
-    new_users = new_row["new_users"] or 0
-
-    # XP 기준 TOP 10
-    cur.execute(
-        """
-        SELECT l.user_id,
-               u.username, u.first_name, u.last_name,
-               SUM(l.xp_delta) AS total_xp,
-               COUNT(*) AS msg_cnt
-        FROM xp_log l
-        LEFT JOIN user_stats u
-          ON u.chat_id = l.chat_id AND u.user_id = l.user_id
-        WHERE l.chat_id=? AND l.created_at >= ? AND l.created_at < ?
-        GROUP BY l.user_id, u.username, u.first_name, u.last_name
-        ORDER BY total_xp DESC
-        LIMIT 10
-        """,
-        (MAIN_CHAT_ID, start_iso, end_iso),
-    )
-    rows = cur.fetchall()
-
-    conn.close()
+    # KST 날짜범위를 unix seconds 로 변환 (xp_log.ts 와 정수 비교)
+    start_ts = _kst_midnight_ts(start_date_kst)
+    end_ts = _kst_midnight_ts(end_date_kst + timedelta(days=1))
+
+    with borrow_conn() as conn:
+        # 총 메시지 수 / 활동 유저 수 / 신규 유저 수 (이 기간에 처음으로 등장한 유저)
+        base_row = conn.execute(
+            SQL_RANGE_COUNTS,
+            (MAIN_CHAT_ID, start_ts, end_ts, MAIN_CHAT_ID, start_ts, end_ts),
+        ).fetchone()
+        msg_count = base_row["msg_count"] or 0
+        user_count = base_row["user_count"] or 0
+        new_users = base_row["new_users"] or 0
+
+        # XP 기준 TOP 10 (기간 내 기록이 없으면 조회하지 않음)
+        # 집계는 user_id 로만 하고, 이름 정보는 상위 10명에 대해서만 따로 조회
+        rows = []
+        names = {}
+        if msg_count > 0:
+            rows = conn.execute(SQL_RANGE_TOP10, (MAIN_CHAT_ID, start_ts, end_ts)).fetchall()
+
+            uids = [row["user_id"] for row in rows]
+            if uids:
+                placeholders = ",".join("?" * len(uids))
+                names = {
+                    row["user_id"]: row
+                    for row in conn.execute(
+                        f"""
+                        SELECT user_id, username, first_name, last_name
+                        FROM user_stats
+                        WHERE chat_id=? AND user_id IN ({placeholders})
+                        """,
+                        (MAIN_CHAT_ID, *uids),
+                    )
+                }
 
     header = (
         f"📊 메인 그룹 활동 요약\n"
@@ -2078,42 +2488,47 @@ def _build_range_summary(start_date_kst: date, end_date_kst: date) -> str:
     if not rows:
         return header + "\n해당 기간에는 활동 기록이 없습니다."
 
-    lines = [header, "\n🏆 XP 기준 TOP 10\n"]
-    for i, row in enumerate(rows, start=1):
-        if row["username"]:
-            name = f"@{row['username']}"
-        else:
-            fn = row["first_name"] or ""
-            ln = row["last_name"] or ""
-            name = (fn + " " + ln).strip() or f"user_id {row['user_id']}"
+    def user_name(uid):
+        name_row = names.get(uid)
+        fallback = f"user_id {uid}"
+        return _display_name(name_row, fallback) if name_row else fallback
 
-        total_xp = row["total_xp"] or 0
-        msg_cnt = row["msg_cnt"] or 0
-        lines.append(f"{i}. {name} - {total_xp} XP / {msg_cnt} 메시지")
+    # SQL_RANGE_TOP10 컬럼 순서(user_id, total_xp, msg_cnt)대로 한 번에 풀어서 사용
+    ranking = "\n".join(
+        f"{i}. {user_name(uid)} - {total_xp or 0} XP / {msg_cnt or 0} 메시지"
+        for i, (uid, total_xp, msg_cnt) in enumerate(rows, start=1)
+    )
+    return f"{header}\n\n🏆 XP 기준 TOP 10\n\n{ranking}"
 
-    return "\n".join(lines)
 
+def _today_range(args):
+    today = kst_now().date()
+    return today, today
 
-async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    chat = update.effective_chat
-    msg = update.message
 
-    if not is_admin(user.id):
-        await msg.reply_text("관리자만 사용할 수 있습니다.")
-        return
-    if not is_private_chat(chat):
-        await msg.reply_text("이 명령어는 봇과의 1:1 대화(디엠)에서만 사용해 주세요.")
-        return
+def _week_range(args):
+    end_date = kst_now().date()
+    return end_date - timedelta(days=6), end_date  # 최근 7일 (오늘 포함)
 
-    now_kst = datetime.utcnow() + timedelta(hours=9)
-    today = now_kst.date()
 
-    text = _build_range_summary(today, today)
-    await msg.reply_text(text)
+def _parsed_range(args):
+    """/range 인자 파싱. 잘못된 입력이면 유저에게 보여줄 메시지로 ValueError"""
+    if len(args) != 2:
+        raise ValueError("사용법: /range YYYY-MM-DD YYYY-MM-DD")
+
+    try:
+        start_date = date.fromisoformat(args[0])
+        end_date = date.fromisoformat(args[1])
+    except ValueError:
+        raise ValueError("날짜 형식이 잘못되었습니다. 예: /range 2025-11-01 2025-11-07") from None
+
+    if end_date < start_date:
+        raise ValueError("끝 날짜는 시작 날짜보다 같거나 이후여야 합니다.")
+    return start_date, end_date
 
 
-async def cmd_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _reply_range_summary(update: Update, context: ContextTypes.DEFAULT_TYPE, range_fn):
+    """/today, /week, /range 공통 처리 (관리자/디엠 체크 → 기간 계산 → 요약 전송)"""
     user = update.effective_user
     chat = update.effective_chat
     msg = update.message
@@ -2125,44 +2540,26 @@ async def cmd_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("이 명령어는 봇과의 1:1 대화(디엠)에서만 사용해 주세요.")
         return
 
-    now_kst = datetime.utcnow() + timedelta(hours=9)
-    end_date = now_kst.date()
-    start_date = end_date - timedelta(days=6)  # 최근 7일 (오늘 포함)
+    try:
+        start_date, end_date = range_fn(context.args)
+    except ValueError as e:
+        await msg.reply_text(str(e))
+        return
 
-    text = _build_range_summary(start_date, end_date)
+    text = await asyncio.to_thread(_build_range_summary, start_date, end_date)
     await msg.reply_text(text)
 
 
-async def cmd_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    chat = update.effective_chat
-    msg = update.message
-    args = context.args
-
-    if not is_admin(user.id):
-        await msg.reply_text("관리자만 사용할 수 있습니다.")
-        return
-    if not is_private_chat(chat):
-        await msg.reply_text("이 명령어는 봇과의 1:1 대화(디엠)에서만 사용해 주세요.")
-        return
+async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _reply_range_summary(update, context, _today_range)
 
-    if len(args) != 2:
-        await msg.reply_text("사용법: /range YYYY-MM-DD YYYY-MM-DD")
-        return
 
-    try:
-        start_date = date.fromisoformat(args[0])
-        end_date = date.fromisoformat(args[1])
-    except ValueError:
-        await msg.reply_text("날짜 형식이 잘못되었습니다. 예: /range 2025-11-01 2025-11-07")
-        return
+async def cmd_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _reply_range_summary(update, context, _week_range)
 
-    if end_date < start_date:
-        await msg.reply_text("끝 날짜는 시작 날짜보다 같거나 이후여야 합니다.")
-        return
 
-    text = _build_range_summary(start_date, end_date)
-    await msg.reply_text(text)
+async def cmd_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _reply_range_summary(update, context, _parsed_range)
 
 
 # -----------------------
@@ -2170,59 +2567,76 @@ async def cmd_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -----------------------
 
 
-async def send_daily_summary(context: ContextTypes.DEFAULT_TYPE):
-    if MAIN_CHAT_ID == 0:
-        return
+async def _send_summary_dm(bot, uid: int, text: str, sem: asyncio.Semaphore, source=None):
+    """
+    관리자 1명에게 요약 DM 전송 (동시 전송 수는 sem 으로 제한)
+    - source: 이미 보낸 요약 메시지 (chat_id, message_id) — 있으면 본문 대신 copy_message 로 복사
+    - 성공하면 보낸 Message(또는 MessageId), 실패하면 None 반환
+    """
+    async with sem:
+        try:
+            if source is not None:
+                return await bot.copy_message(
+                    chat_id=uid, from_chat_id=source[0], message_id=source[1]
+                )
+            return await bot.send_message(chat_id=uid, text=text)
+        except Exception:
+            logger.exception("daily summary DM 실패 (user_id=%s)", uid)
+            return None
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT username,first_name,last_name,xp,level
-        FROM user_stats
-        WHERE chat_id=?
-        ORDER BY xp DESC
-        LIMIT 10
-        """,
-        (MAIN_CHAT_ID,),
-    )
-    rows = cur.fetchall()
 
-    cur.execute(
-        "SELECT COUNT(*) AS c FROM user_stats WHERE chat_id=?",
-        (MAIN_CHAT_ID,),
-    )
-    total_users = cur.fetchone()["c"]
-    conn.close()
+def _build_daily_summary_text(chat_id: int) -> str:
+    """Daily 요약 텍스트 생성 — DB 조회 + 포맷팅 (to_thread 에서 호출)"""
+    # TOP 10 + 전체 유저 수를 쿼리 한 번으로
+    with borrow_conn() as conn:
+        rows = conn.execute(SQL_XP_TOP10_WITH_TOTAL, (chat_id,)).fetchall()
 
-    now_kst = datetime.utcnow() + timedelta(hours=9)
+    now_kst = kst_now()
 
     if not rows:
         body = "오늘 기록된 활동/XP 데이터가 없습니다."
     else:
-        lines = ["오늘 기준 메인 그룹 XP 상위 10명:\n"]
-        for i, row in enumerate(rows, start=1):
-            if row["username"]:
-                name = f"@{row['username']}"
-            else:
-                fn = row["first_name"] or ""
-                ln = row["last_name"] or ""
-                name = (fn + " " + ln).strip() or "이름없음"
-            lines.append(f"{i}. {name} - Lv.{row['level']} ({row['xp']} XP)")
-        lines.append(f"\n총 기록된 유저 수: {total_users}명")
-        body = "\n".join(lines)
+        ranking = "\n".join(
+            f"{i}. {_display_name(row)} - Lv.{row['level']} ({row['xp']} XP)"
+            for i, row in enumerate(rows, start=1)
+        )
+        body = (
+            "오늘 기준 메인 그룹 XP 상위 10명:\n\n"
+            f"{ranking}\n\n"
+            f"총 기록된 유저 수: {rows[0]['total_users']}명"
+        )
 
-    text = (
+    return (
         f"📊 Daily XP 요약 (KST 기준)\n"
         f"{now_kst.strftime('%Y-%m-%d %H:%M')}\n\n"
         f"{body}"
     )
 
-    for uid in all_admin_targets():
-        try:
-            await context.bot.send_message(chat_id=uid, text=text)
-        except Exception:
-            logger.exception("daily summary DM 실패 (user_id=%s)", uid)
+
+async def send_daily_summary(context: ContextTypes.DEFAULT_TYPE):
+    if MAIN_CHAT_ID == 0:
+        return
+
+    # 조회/텍스트 생성은 별도 스레드에서 (이벤트 루프가 다른 업데이트를 계속 처리하도록)
+    # 텍스트는 한 번만 만들고, 모든 관리자에게 같은 문자열을 그대로 전송
+    text = await asyncio.to_thread(_build_daily_summary_text, MAIN_CHAT_ID)
+
+    # 전송은 봇의 HTTP 커넥션 풀(keep-alive)을 공유하므로 관리자 수만큼 새로 연결하지 않음
+    sem = asyncio.Semaphore(ADMIN_DM_CONCURRENCY)
+    pending = list(all_admin_targets())
+
+    # 본문은 한 번만 전송: 성공할 때까지 한 명씩 보내고,
+    # 나머지 관리자에게는 그 메시지를 copy_message 로 동시에 복사
+    source = None
+    while pending and source is None:
+        uid = pending.pop(0)
+        sent = await _send_summary_dm(context.bot, uid, text, sem)
+        if sent is not None:
+            source = (uid, sent.message_id)
+
+    await asyncio.gather(
+        *(_send_summary_dm(context.bot, uid, text, sem, source) for uid in pending)
+    )
 
 
 # -----------------------
@@ -2230,26 +2644,65 @@ async def send_daily_summary(context: ContextTypes.DEFAULT_TYPE):
 # -----------------------
 
 
-async def send_daily_backup(context: ContextTypes.DEFAULT_TYPE):
+async def _send_backup_dm(bot, uid: int, document, filename: str, sem: asyncio.Semaphore):
     """
-    매일 23:59 KST 기준 xp_bot.db 를 zip으로 압축하여
-    OWNER + 관리자에게 DM으로 전송
+    관리자 1명에게 백업 파일 DM 전송 (동시 전송 수는 sem 으로 제한)
+    - document: 파일 bytes 또는 이미 업로드된 file_id
+    - 성공하면 보낸 Message, 실패하면 None 반환
     """
-    try:
-        zip_path = backup_db_to_zip()
-    except Exception:
-        logger.exception("자동 백업 zip 생성 실패")
-        return
-
-    for uid in all_admin_targets():
+    async with sem:
         try:
-            await context.bot.send_document(
+            return await bot.send_document(
                 chat_id=uid,
-                document=open(zip_path, "rb"),
+                document=document,
+                filename=filename,
                 caption="📦 Daily 자동 백업 파일입니다.",
             )
         except Exception:
             logger.exception("daily backup DM 실패 (user_id=%s)", uid)
+            return None
+
+
+async def send_daily_backup(context: ContextTypes.DEFAULT_TYPE):
+    """
+    매일 23:59 KST 기준 xp_bot.db 를 압축하여
+    OWNER + 관리자에게 DM으로 전송
+    """
+    try:
+        backup_path = await asyncio.to_thread(backup_db_archive)
+        backup_data = await asyncio.to_thread(read_file_bytes, backup_path)
+    except Exception:
+        logger.exception("자동 백업 파일 생성 실패")
+        return
+
+    filename = os.path.basename(backup_path)
+    sem = asyncio.Semaphore(ADMIN_DM_CONCURRENCY)
+    pending = list(all_admin_targets())
+
+    # 파일은 한 번만 업로드: 업로드가 성공할 때까지 한 명씩 보내고,
+    # 나머지 관리자에게는 받은 file_id 로 재업로드 없이 동시에 전송
+    file_id = None
+    while pending and file_id is None:
+        sent = await _send_backup_dm(context.bot, pending.pop(0), backup_data, filename, sem)
+        if sent is not None:
+            file_id = sent.document.file_id
+
+    await asyncio.gather(
+        *(_send_backup_dm(context.bot, uid, file_id, filename, sem) for uid in pending)
+    )
+
+
+async def daily_job(context: ContextTypes.DEFAULT_TYPE):
+    """매일 23:59 KST — 요약 DM 과 자동 백업을 동시에 진행 (백업 압축은 스레드에서)"""
+    # 한쪽이 실패해도 다른 쪽은 끝까지 진행하고, 각각의 예외를 따로 기록
+    results = await asyncio.gather(
+        send_daily_summary(context),
+        send_daily_backup(context),
+        return_exceptions=True,
+    )
+    for name, result in zip(("daily summary", "daily backup"), results):
+        if isinstance(result, BaseException):
+            logger.error("%s 작업 실패", name, exc_info=result)
 
 
 # -----------------------
@@ -2532,65 +2985,116 @@ async def auto_end_lottery(context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(chat_id=chat_id, text=text)
 
 
+# -----------------------
+# 명령어 테이블 / 디스패치
+# -----------------------
+
+
+# 일반 메시지(명령어 제외) 필터 — 모듈 로드 시 한 번만 조합
+TEXT_NOCMD = filters.TEXT & ~filters.COMMAND
+
+# 명령어 이름 → 핸들러
+COMMANDS = {
+    # 기본 명령어
+    "start": cmd_start,
+    "chatid": cmd_chatid,
+    "stats": cmd_stats,
+    "xp": cmd_stats,
+    "ranking": cmd_ranking,
+    "rank": cmd_ranking,
+    "daily": cmd_daily,
+    "mylink": cmd_mylink,
+    "myinvites": cmd_myinvites,
+    "invites_ranking": cmd_invites_ranking,
+    # 로터리(추첨)
+    "lottery": cmd_lottery,
+    "join": cmd_join_lottery,
+    "lottery_end": cmd_lottery_end,
+    # 관리자 / OWNER 명령어
+    "listadmins": cmd_listadmins,
+    "addadmin": cmd_addadmin,
+    "deladmin": cmd_deladmin,
+    "refuser": cmd_refuser,
+    "userstats": cmd_userstats,
+    "resetxp": cmd_resetxp,
+    # XP 키워드 관리
+    "addxpbonus": cmd_addxpbonus,
+    "addxpbonuses": cmd_addxpbonuses,
+    "addxpblock": cmd_addxpblock,
+    "delxpword": cmd_delxpword,
+    "listxpwords": cmd_listxpwords,
+    # 안티 스팸/초대/캠페인 설정
+    "setcooldown": cmd_setcooldown,
+    "setdailycap": cmd_setdailycap,
+    "setinvxp": cmd_setinvxp,
+    "setcampaign": cmd_setcampaign,
+    "clearcampaign": cmd_clearcampaign,
+    "add_xp": cmd_add_xp,
+    # 기간 요약
+    "today": cmd_today,
+    "week": cmd_week,
+    "range": cmd_range,
+}
+
+
+class CommandTableHandler(CommandHandler):
+    """
+    명령어 dict 하나를 처리하는 CommandHandler.
+    명령어마다 CommandHandler 를 따로 등록하면 업데이트마다 핸들러 목록을 순서대로 검사하므로,
+    하나만 등록하고 명령어 이름으로 콜백을 바로 찾는다.
+    (명령어 파싱 / @봇이름 / context.args 처리는 CommandHandler 그대로 사용)
+    """
+
+    __slots__ = ("table",)
+
+    def __init__(self, table: dict):
+        super().__init__(list(table), self._dispatch)
+        self.table = {name.lower(): callback for name, callback in table.items()}
+
+    async def _dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        message = update.effective_message
+        command = message.text[1 : message.entities[0].length].split("@")[0].lower()
+        return await self.table[command](update, context)
+
+
 # -----------------------
 # MAIN
 # -----------------------
 
 
+async def post_shutdown(app: Application):
+    """봇 종료 시 버퍼에 남은 xp_log 를 기록하고 DB 연결을 닫음"""
+    try:
+        await asyncio.to_thread(flush_xp_log)
+    except Exception:
+        logger.exception("종료 시 xp_log flush 실패")
+    close_config_conn()
+    DB_POOL.close()
+
+
 def main():
     init_db()
 
-    app: Application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # 일반 API 호출은 HTTP/2 로 — 관리자 DM 일괄 전송 등 동시 요청이 연결 하나에 다중화됨
+    # (getUpdates 롱폴링은 요청이 하나뿐이라 기본 HTTP/1.1 그대로)
+    app: Application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .http_version("2")
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # 일반 메시지 → XP
     app.add_handler(
         MessageHandler(
-            filters.TEXT & (~filters.COMMAND),
+            TEXT_NOCMD,
             handle_message,
         )
     )
 
-    # 기본 명령어
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("chatid", cmd_chatid))
-    app.add_handler(CommandHandler(["stats", "xp"], cmd_stats))
-    app.add_handler(CommandHandler(["ranking", "rank"], cmd_ranking))
-    app.add_handler(CommandHandler("daily", cmd_daily))
-    app.add_handler(CommandHandler("mylink", cmd_mylink))
-    app.add_handler(CommandHandler("myinvites", cmd_myinvites))
-    app.add_handler(CommandHandler("invites_ranking", cmd_invites_ranking))
-
-    # 로터리(추첨)
-    app.add_handler(CommandHandler("lottery", cmd_lottery))
-    app.add_handler(CommandHandler("join", cmd_join_lottery))
-    app.add_handler(CommandHandler("lottery_end", cmd_lottery_end))
-
-    # 관리자 / OWNER 명령어
-    app.add_handler(CommandHandler("listadmins", cmd_listadmins))
-    app.add_handler(CommandHandler("addadmin", cmd_addadmin))
-    app.add_handler(CommandHandler("deladmin", cmd_deladmin))
-    app.add_handler(CommandHandler("refuser", cmd_refuser))
-    app.add_handler(CommandHandler("userstats", cmd_userstats))
-    app.add_handler(CommandHandler("resetxp", cmd_resetxp))
-
-    # XP 키워드 관리
-    app.add_handler(CommandHandler("addxpbonus", cmd_addxpbonus))
-    app.add_handler(CommandHandler("addxpblock", cmd_addxpblock))
-    app.add_handler(CommandHandler("delxpword", cmd_delxpword))
-    app.add_handler(CommandHandler("listxpwords", cmd_listxpwords))
-
-    # 안티 스팸/초대/캠페인 설정
-    app.add_handler(CommandHandler("setcooldown", cmd_setcooldown))
-    app.add_handler(CommandHandler("setdailycap", cmd_setdailycap))
-    app.add_handler(CommandHandler("setinvxp", cmd_setinvxp))
-    app.add_handler(CommandHandler("setcampaign", cmd_setcampaign))
-    app.add_handler(CommandHandler("clearcampaign", cmd_clearcampaign))
-    app.add_handler(CommandHandler("add_xp", cmd_add_xp))
-
-    # 기간 요약
-    app.add_handler(CommandHandler("today", cmd_today))
-    app.add_handler(CommandHandler("week", cmd_week))
-    app.add_handler(CommandHandler("range", cmd_range))
+    # 명령어 (COMMANDS 테이블 기반 단일 핸들러)
+    app.add_handler(CommandTableHandler(COMMANDS))
 
     # 초대 추적
     app.add_handler(
@@ -2600,22 +3104,29 @@ def main():
         )
     )
 
-    # 매일 23:59 KST (UTC 14:59) 요약 전송
-    app.job_queue.run_daily(
-        send_daily_summary,
-        time=time(hour=14, minute=59, tzinfo=timezone.utc),
-        name="daily_summary",
+    # xp_log 버퍼 주기적 flush
+    app.job_queue.run_repeating(
+        flush_xp_log_job,
+        interval=XP_LOG_FLUSH_INTERVAL,
+        name="flush_xp_log",
     )
 
-    # 매일 23:59 KST (UTC 14:59) 자동 백업
+    # 매일 23:59 KST (UTC 14:59) 요약 전송 + 자동 백업
+    # - 이벤트 루프가 바빠 늦게 깨어나도 1시간 안이면 실행, 밀린 실행은 한 번으로 합침, 동시 실행 금지
     app.job_queue.run_daily(
-        send_daily_backup,
+        daily_job,
         time=time(hour=14, minute=59, tzinfo=timezone.utc),
-        name="daily_backup",
+        name="daily",
+        job_kwargs={"misfire_grace_time": 3600, "coalesce": True, "max_instances": 1},
     )
 
     logger.info("XP Bot started")
-    app.run_polling()
+    # 긴 long polling(최대 50초)으로 빈 getUpdates 호출을 줄이고,
+    # 처리하는 업데이트 종류만 받음 (chat_member 는 명시해야만 전달됨)
+    app.run_polling(
+        timeout=50,
+        allowed_updates=[Update.MESSAGE, Update.CHAT_MEMBER],
+    )
 
 
 if __name__ == "__main__":